@@ -0,0 +1,272 @@
+# backends.py
+# Серверы моделей для ИИ-помощника: Ollama, OpenAI-совместимый сервер и заглушка для тестов
+
+import os
+import abc
+import json
+
+from storage import atomic_write
+from context import estimate_tokens
+
+CONFIG_PATH = os.path.join(os.path.expanduser("~"), ".tcode", "ai.json")
+
+DEFAULT_CONFIG = {
+    "backend": "ollama",  # ollama, openai, stub
+    "endpoint": "http://localhost:11434",
+    "api_key": "",  # для OpenAI-совместимых серверов
+    "model": "tinyllama",
+    "num_ctx": 2048,  # окно модели в токенах
+    "cost": 0,  # условная цена запроса к основной модели при маршрутизации
+    "num_thread": None,  # None - выбирает сервер
+    "keep_alive": "5m",  # сколько сервер держит модель в памяти после запроса
+    # Дополнительные модели для маршрутизации: [{"name", "num_ctx", "cost"}]
+    "models": [],
+}
+
+
+def _positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_config(config):
+    """Проверка типов настроек; ValueError с описанием первой ошибки"""
+    if config.get("backend") not in BACKENDS:
+        raise ValueError(f"Неизвестный сервер модели: {config.get('backend')}")
+    for key in ("endpoint", "model"):
+        if not isinstance(config.get(key), str) or not config[key].strip():
+            raise ValueError(f"{key}: нужна непустая строка")
+    if not isinstance(config.get("api_key"), str):
+        raise ValueError("api_key: нужна строка")
+    if not _positive_int(config.get("num_ctx")):
+        raise ValueError("num_ctx: нужно целое число больше нуля")
+    if config.get("num_thread") is not None and not _positive_int(config["num_thread"]):
+        raise ValueError("num_thread: нужно целое число больше нуля или null")
+    if not _number(config.get("cost")):
+        raise ValueError("cost: нужно число")
+    try:
+        parse_duration(config.get("keep_alive"))
+    except (TypeError, ValueError):
+        raise ValueError(f"keep_alive: непонятная длительность {config.get('keep_alive')!r}")
+    models = config.get("models")
+    if not isinstance(models, list):
+        raise ValueError("models: нужен список")
+    for model in models:
+        if not isinstance(model, dict) or not isinstance(model.get("name"), str) or not model["name"].strip():
+            raise ValueError("models: у каждой модели нужно непустое имя name")
+        if "num_ctx" in model and not _positive_int(model["num_ctx"]):
+            raise ValueError(f"models[{model['name']}].num_ctx: нужно целое число больше нуля")
+        if "cost" in model and not _number(model["cost"]):
+            raise ValueError(f"models[{model['name']}].cost: нужно число")
+
+
+def load_config(path=CONFIG_PATH, warnings=None):
+    """Настройки из файла поверх значений по умолчанию.
+    Испорченный файл заменяется значениями по умолчанию, причина добавляется в список warnings"""
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("нужен объект JSON")
+        config.update(data)
+        validate_config(config)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        if warnings is not None:
+            warnings.append(f"Настройки ИИ из {path} не применены ({e}), используются значения по умолчанию")
+        config = dict(DEFAULT_CONFIG)
+    return config
+
+
+def save_config(config, path=CONFIG_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write(path, json.dumps(config, ensure_ascii=False, indent=2))
+
+
+def parse_duration(value):
+    """keep_alive в секундах: "30s", "5m", "1h" или число; отрицательное - держать всегда"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value).strip()
+    units = {"s": 1, "m": 60, "h": 3600}
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def route_model(config, prompt, reserve=0):
+    """Самая дешевая модель, в окно которой помещаются промпт и reserve токенов ответа"""
+    candidates = [{"name": config["model"], "num_ctx": config["num_ctx"], "cost": config.get("cost", 0)}]
+    candidates += [m for m in config.get("models", []) if m.get("name")]
+    needed = estimate_tokens(prompt) + reserve
+    fitting = [m for m in candidates if m.get("num_ctx", config["num_ctx"]) >= needed]
+    if fitting:
+        return min(fitting, key=lambda m: m.get("cost", 0))
+    # Не помещается никуда - берем самое большое окно, сервер обрежет начало промпта
+    return max(candidates, key=lambda m: m.get("num_ctx", config["num_ctx"]))
+
+
+class Backend(abc.ABC):
+    """Сервер модели. generate возвращает (ответ, context для продолжения диалога или None)"""
+
+    name = None
+    supports_context = False
+
+    def __init__(self, config):
+        self.config = config
+
+    @abc.abstractmethod
+    def generate(self, session, handle, model, prompt, options, tokens=None, stream=True,
+                 on_token=None, timeout=None):
+        """Генерация ответа; on_token(фрагмент) вызывается по мере потока"""
+
+    def warm_up(self, session, model, keep_alive, timeout=None):
+        """Загрузка модели заранее (keep_alive=0 - выгрузка); по умолчанию ничего не делает"""
+
+    def _post(self, session, handle, url, data, stream, timeout, headers=None):
+        response = session.post(url, json=data, stream=stream, timeout=timeout, headers=headers)
+        handle.set_response(response)
+        handle.check()
+        if response.status_code != 200:
+            raise Exception(f"API Error {response.status_code}: {response.text}")
+        return response
+
+
+class OllamaBackend(Backend):
+    """Ollama /api/generate с потоком NDJSON и переиспользованием context"""
+
+    name = "ollama"
+    supports_context = True
+
+    def generate(self, session, handle, model, prompt, options, tokens=None, stream=True,
+                 on_token=None, timeout=None):
+        options = dict(options, num_ctx=model.get("num_ctx", self.config["num_ctx"]))
+        if self.config.get("num_thread"):
+            options["num_thread"] = self.config["num_thread"]
+        data = {
+            "model": model["name"],
+            "prompt": prompt,
+            "stream": stream,
+            "options": options,
+            "keep_alive": self.config["keep_alive"],
+        }
+        if tokens:
+            data["context"] = tokens
+
+        url = self.config["endpoint"].rstrip("/") + "/api/generate"
+        response = self._post(session, handle, url, data, stream, timeout)
+
+        if not stream:
+            result = response.json()
+            return result.get('response', '').strip(), result.get('context')
+
+        # Поток NDJSON: по объекту на строку, каждый несет очередной фрагмент ответа
+        parts = []
+        new_tokens = None
+        with response:
+            for line in response.iter_lines():
+                handle.check()
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise Exception(chunk["error"])
+                token = chunk.get("response", "")
+                if token:
+                    parts.append(token)
+                    if on_token:
+                        on_token(token)
+                if chunk.get("done"):
+                    new_tokens = chunk.get("context")
+                    break
+        return "".join(parts).strip(), new_tokens
+
+    def warm_up(self, session, model, keep_alive, timeout=None):
+        # Запрос без prompt только загружает модель и продлевает ее keep_alive
+        url = self.config["endpoint"].rstrip("/") + "/api/generate"
+        response = session.post(url, json={"model": model, "keep_alive": keep_alive}, timeout=timeout)
+        if response.status_code != 200:
+            raise Exception(f"API Error {response.status_code}: {response.text}")
+
+
+class OpenAIBackend(Backend):
+    """OpenAI-совместимый сервер (llama.cpp, vLLM, LM Studio): /v1/chat/completions с потоком SSE"""
+
+    name = "openai"
+
+    def generate(self, session, handle, model, prompt, options, tokens=None, stream=True,
+                 on_token=None, timeout=None):
+        data = {
+            "model": model["name"],
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": stream,
+        }
+        for key in ("temperature", "top_p", "max_tokens", "stop"):
+            if key in options:
+                data[key] = options[key]
+        headers = {"Authorization": f"Bearer {self.config['api_key']}"} if self.config.get("api_key") else None
+
+        url = self.config["endpoint"].rstrip("/") + "/v1/chat/completions"
+        response = self._post(session, handle, url, data, stream, timeout, headers)
+
+        if not stream:
+            result = response.json()
+            return result["choices"][0]["message"]["content"].strip(), None
+
+        parts = []
+        with response:
+            for line in response.iter_lines():
+                handle.check()
+                if not line.startswith(b"data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == b"[DONE]":
+                    break
+                chunk = json.loads(payload)
+                if chunk.get("error"):
+                    raise Exception(chunk["error"])
+                choices = chunk.get("choices") or [{}]
+                token = (choices[0].get("delta") or {}).get("content") or ""
+                if token:
+                    parts.append(token)
+                    if on_token:
+                        on_token(token)
+        return "".join(parts).strip(), None
+
+    def warm_up(self, session, model, keep_alive, timeout=None):
+        # Управлять загрузкой такие серверы не дают - проверяем только доступность
+        headers = {"Authorization": f"Bearer {self.config['api_key']}"} if self.config.get("api_key") else None
+        response = session.get(self.config["endpoint"].rstrip("/") + "/v1/models", timeout=timeout, headers=headers)
+        if response.status_code != 200:
+            raise Exception(f"API Error {response.status_code}: {response.text}")
+
+
+class StubBackend(Backend):
+    """Заглушка без сети: отвечает последней строкой запроса, для тестов и работы без сервера"""
+
+    name = "stub"
+
+    def generate(self, session, handle, model, prompt, options, tokens=None, stream=True,
+                 on_token=None, timeout=None):
+        question = prompt.rsplit("Вот его запрос:", 1)[-1].replace("Ответ:", "").strip()
+        answer = f"[{model['name']}] {question}"
+        if stream and on_token:
+            for word in answer.split(" "):
+                handle.check()
+                on_token(word + " ")
+        return answer, None
+
+
+BACKENDS = {backend.name: backend for backend in (OllamaBackend, OpenAIBackend, StubBackend)}
+
+
+def create_backend(config):
+    try:
+        return BACKENDS[config["backend"]](config)
+    except KeyError:
+        raise ValueError(f"Неизвестный сервер модели: {config['backend']}")
@@ -0,0 +1,156 @@
+# cache.py
+# Кэш ответов ИИ: LRU в памяти и необязательный уровень на диске
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from storage import atomic_write
+
+
+def response_key(model, options, prompt):
+    """Ключ ответа: модель, параметры генерации и хэш итогового промпта"""
+    payload = json.dumps({"model": model, "options": options, "prompt": prompt},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU-кэш ответов модели; на диске - с вытеснением по размеру и сроком жизни"""
+
+    def __init__(self, maxsize=128, directory=None, max_disk_bytes=50 * 1024 * 1024, ttl=None):
+        self.maxsize = maxsize
+        self.directory = directory  # None - только память
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl  # секунд, None - без срока
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # ключ -> (время записи, ответ)
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _file(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Ответ из кэша или None; запись с диска поднимается в память"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if not self._expired(item[0]):
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._items[key]
+
+        item = self._read_disk(key) if self.directory else None
+        with self._lock:
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, item)
+        return item[1]
+
+    def put(self, key, response):
+        created = time.time()
+        with self._lock:
+            self._store(key, (created, response))
+        if self.directory:
+            self._write_disk(key, created, response)
+
+    def _store(self, key, item):
+        if self.maxsize <= 0:
+            return
+        self._items[key] = item
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def _read_disk(self, key):
+        path = self._file(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(data.get("created", 0)):
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # время изменения служит отметкой последнего использования
+        except OSError:
+            pass
+        return data["created"], data["response"]
+
+    def _write_disk(self, key, created, response):
+        path = self._file(key)
+        text = json.dumps({"created": created, "response": response}, ensure_ascii=False)
+        try:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            atomic_write(path, text)
+            with self._lock:
+                self._disk_bytes += os.path.getsize(path) - old_size
+                over_limit = self._disk_bytes > self.max_disk_bytes
+        except OSError:
+            return
+        if over_limit:
+            self._evict_disk()
+
+    def _disk_entries(self):
+        """[(путь, размер, время использования)] файлов кэша на диске"""
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict_disk(self):
+        """Удаление давно не использованных файлов до 90% лимита"""
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_disk_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            if self._remove(path):
+                total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+        if self.directory:
+            for path, _, _ in self._disk_entries():
+                self._remove(path)
+            with self._lock:
+                self._disk_bytes = 0
+
+    def stats(self):
+        return {"size": len(self._items), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses, "disk_bytes": self._disk_bytes}
@@ -2,10 +2,24 @@ import io
 import sys
 import re
 import ast
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
 
 commands = {}
 variables = {}
 
+# Таблица диспетчеризации: одна общая регулярка на все команды.
+# Собирается при первом поиске после регистрации, а не на каждую add_command
+_dispatch = (None, [])  # (регулярка, команды по номерам групп) - заменяются одним присваиванием
+_dispatch_dirty = False
+_dispatch_lock = threading.Lock()
+
+class ErrorResult(str):
+    """Результат, сообщающий об ошибке выполнения; при выводе это обычная строка"""
+
+
 class Command:
     def __init__(self, name, arg_count, func, start='', end=''):
         self.name = name
@@ -15,7 +29,44 @@ class Command:
         self.end = end
 
 def add_command(name, arg_count, func, start='', end=''):
+    global _dispatch_dirty
     commands[name] = Command(name, arg_count, func, start, end)
+    _dispatch_dirty = True
+
+def _rebuild_dispatch():
+    """Сборка общей регулярки для всех зарегистрированных команд"""
+    global _dispatch, _dispatch_dirty
+
+    _dispatch_dirty = False  # регистрация во время сборки снова пометит таблицу
+    table = list(commands.values())
+    alternatives = []
+    for idx, cmd in enumerate(table):
+        pattern_parts = []
+        if cmd.start:
+            pattern_parts.append(f"{re.escape(cmd.start)}\\s*")
+        pattern_parts.append(f"{re.escape(cmd.name)}\\s*\\((?P<a{idx}>.*?)\\)")
+        if cmd.end:
+            pattern_parts.append(f"\\s*{re.escape(cmd.end)}")
+        # Внешняя группа закрывается последней, поэтому lastgroup укажет на команду
+        alternatives.append(f"(?P<c{idx}>{''.join(pattern_parts)})")
+
+    pattern = re.compile("^(?:" + "|".join(alternatives) + ")$", re.DOTALL) if table else None
+    _dispatch = (pattern, table)
+
+def resolve_command(command_str):
+    """Поиск команды для строки за один проход регулярки -> (Command, params) или (None, None)"""
+    if _dispatch_dirty:
+        with _dispatch_lock:
+            if _dispatch_dirty:
+                _rebuild_dispatch()
+    pattern, table = _dispatch
+    if pattern is None:
+        return None, None
+    match = pattern.match(command_str)
+    if not match:
+        return None, None
+    idx = int(match.lastgroup[1:])
+    return table[idx], match.group(f"a{idx}")
 
 def split_args(params):
     parts = []
@@ -66,95 +117,198 @@ def try_eval(arg):
     except:
         return arg  # оставить как строку/идентификатор
 
+class CodeCache:
+    """LRU-кэш скомпилированных блоков Python, ключ - (хэш исходника, режим)"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()  # кэш общий для потоков выполнения разных вкладок
+
+    def _lookup(self, key):
+        with self._lock:
+            code_obj = self._items.get(key)
+            if code_obj is not None:
+                self._items.move_to_end(key)
+            return code_obj
+
+    def _store(self, key, code_obj):
+        with self._lock:
+            self._items[key] = code_obj
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def get(self, code):
+        """Возвращает (режим, объект кода); исходник разбирается не более одного раза"""
+        digest = hashlib.sha1(code.encode('utf-8')).digest()
+        for mode in ('eval', 'exec'):
+            code_obj = self._lookup((digest, mode))
+            if code_obj is not None:
+                self.hits += 1
+                return mode, code_obj
+
+        self.misses += 1
+        try:
+            # Пытаемся разобрать как выражение (eval)
+            mode, code_obj = 'eval', compile(code, '<string>', 'eval')
+        except SyntaxError:
+            # Если не получилось — компилируем как обычный код (exec)
+            mode, code_obj = 'exec', compile(code, '<string>', 'exec')
+        if self.maxsize > 0:
+            self._store((digest, mode), code_obj)
+        return mode, code_obj
+
+    def resize(self, maxsize):
+        """Изменение размера кэша с вытеснением лишних записей"""
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._items) > max(maxsize, 0):
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {"size": len(self._items), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses}
+
+
+code_cache = CodeCache()
+
+# Буфер вывода текущего контекста выполнения (у каждого потока свой)
+_output_capture = contextvars.ContextVar("output_capture", default=None)
+_stdout_lock = threading.Lock()
+
+class StdoutProxy:
+    """Замена sys.stdout: print пишет в буфер своего контекста выполнения, иначе - в исходный поток"""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def _target(self):
+        buffer = _output_capture.get()
+        return buffer if buffer is not None else self.fallback
+
+    def write(self, text):
+        target = self._target()
+        if target is None:
+            return len(text)  # под pythonw sys.stdout нет - вывод вне захвата отбрасывается
+        return target.write(text)
+
+    def flush(self):
+        target = self._target()
+        if target is not None:
+            target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+def _install_stdout_proxy():
+    """Однократная установка прокси (повторно - если sys.stdout заменили извне)"""
+    if not isinstance(sys.stdout, StdoutProxy):
+        with _stdout_lock:
+            if not isinstance(sys.stdout, StdoutProxy):
+                sys.stdout = StdoutProxy(sys.stdout)
+
+def _describe(e):
+    """Текст исключения для вывода; у MemoryError и многих других сообщение пустое"""
+    if isinstance(e, MemoryError):
+        return "превышен лимит памяти"
+    return str(e) or type(e).__name__
+
 def execute_python_code(code):
     code = code.replace('\t', '   ')
-    old_stdout = sys.stdout
-    sys.stdout = mystdout = io.StringIO()
+    _install_stdout_proxy()
+    mystdout = io.StringIO()
+    token = _output_capture.set(mystdout)
 
     try:
-        # Пытаемся разобрать как выражение (eval)
-        try:
-            expr = ast.parse(code, mode='eval')
-            compiled = compile(expr, '<string>', 'eval')
+        mode, compiled = code_cache.get(code)
+        if mode == 'eval':
             result = eval(compiled, {}, variables)
             output = f"{result}\n" if result is not None else ""
-        except SyntaxError:
-            # Если не получилось — исполняем как обычный код (exec)
-            exec(code, {}, variables)
+        else:
+            exec(compiled, {}, variables)
             output = ""
-        
-        sys.stdout = old_stdout
+
         output += mystdout.getvalue()
         return output.strip() if output else "ОК"
 
     except Exception as e:
-        sys.stdout = old_stdout
-        return f"ошибка python: {e}"
+        return ErrorResult(f"ошибка python: {_describe(e)}")
 
+    finally:
+        # Буфер снимается и при прерывании выполнения (BaseException)
+        _output_capture.reset(token)
 
 
-def parse_command_single(command_str):
-    for name, cmd in commands.items():
-        start = cmd.start
-        end = cmd.end
-
-        pattern_parts = []
-        if start:
-            pattern_parts.append(f"{re.escape(start)}\\s*")
-        pattern_parts.append(f"{re.escape(name)}\\s*\\((.*?)\\)")
-        if end:
-            pattern_parts.append(f"\\s*{re.escape(end)}")
-
-        pattern = "^" + "".join(pattern_parts) + "$"
-        match = re.match(pattern, command_str, re.DOTALL)
 
-        if match:
-            params = match.group(1).strip()
-            try:
-                args = [try_eval(arg.strip()) for arg in split_args(params)]
-            except Exception as e:
-                return f"Ошибка в параметрах: {e}"
+def parse_command_single(command_str):
+    cmd, params = resolve_command(command_str)
+    if cmd is None:
+        return execute_python_code(command_str)
 
-            if cmd.arg_count != len(args):
-                return f"Нужно {cmd.arg_count} аргументов, получено {len(args)}"
+    params = params.strip()
+    try:
+        args = [try_eval(arg.strip()) for arg in split_args(params)]
+    except Exception as e:
+        return ErrorResult(f"Ошибка в параметрах: {e}")
 
-            try:
-                return cmd.func(*args)
-            except Exception as e:
-                return f"Ошибка выполнения: {e}"
+    if cmd.arg_count != len(args):
+        return ErrorResult(f"Нужно {cmd.arg_count} аргументов, получено {len(args)}")
 
-    return execute_python_code(command_str)
+    try:
+        return cmd.func(*args)
+    except Exception as e:
+        return ErrorResult(f"Ошибка выполнения: {_describe(e)}")
 
-def parse_command(command_str):
-    command_str = command_str.strip()
-    if not command_str:
-        return "Пустая команда"
+def _as_text(result):
+    # str() от ErrorResult вернул бы простую строку и потерял признак ошибки
+    return result if isinstance(result, str) else str(result)
 
-    blocks = command_str.splitlines()
+def iter_command_results(command_str):
+    """Потоковое выполнение скрипта: результат каждой команды и блока Python отдается сразу"""
     buffer = []
-    output = []
 
     def flush_python_block():
         if buffer:
             py_code = "\n".join(buffer).strip()
-            if py_code:
-                result = execute_python_code(py_code)
-                output.append(result)
             buffer.clear()
+            if py_code:
+                return execute_python_code(py_code)
+        return None
 
-    for line in blocks:
+    # Строки читаются по одной, без разбиения всего скрипта в список
+    for line in io.StringIO(command_str):
+        line = line.rstrip("\r\n")
         stripped = line.strip()
         if not stripped:
             continue
         if stripped.startswith("!"):
-            flush_python_block()
+            result = flush_python_block()
+            if result:
+                yield _as_text(result)
             result = parse_command_single(stripped)
-            output.append(result)
+            if result:
+                yield _as_text(result)
         else:
             buffer.append(line)
 
-    flush_python_block()
-    return "\n".join(str(o) for o in output if o)
+    result = flush_python_block()
+    if result:
+        yield _as_text(result)
+
+def parse_command(command_str):
+    command_str = command_str.strip()
+    if not command_str:
+        return "Пустая команда"
+    return "\n".join(iter_command_results(command_str))
 # ==== Примеры команд ====
 
 def create_var(name, value):
@@ -171,7 +325,13 @@ def call_command(name, *args):
         raise ValueError(f"Нужно {cmd.arg_count} аргументов, получено {len(args)}")
     return cmd.func(*args)
 
-def t_compile(command_str):
+def t_compile(command_str, stream=False):
+    """Выполнение T-Code; при stream=True возвращает генератор результатов"""
+    if stream:
+        command_str = command_str.strip()
+        if not command_str:
+            return iter(["Пустая команда"])
+        return iter_command_results(command_str)
     return parse_command(command_str)
 
 
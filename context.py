@@ -0,0 +1,172 @@
+# context.py
+# Сборка ограниченного контекста кода для запросов к ИИ
+
+import ast
+import math
+import threading
+
+CHARS_PER_TOKEN = 3.5  # среднее для кода; точный токенизатор модели здесь не нужен
+
+
+def estimate_tokens(text):
+    """Быстрая оценка числа токенов по длине текста"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def trim_to_budget(text, budget):
+    """Обрезка текста по целым строкам до бюджета токенов"""
+    if estimate_tokens(text) <= budget:
+        return text
+    kept = []
+    used = 0
+    for line in text.splitlines():
+        cost = estimate_tokens(line + "\n")
+        if used + cost > budget:
+            if not kept:
+                # Первая же строка длиннее бюджета (минифицированный код, данные) - режем ее по символам
+                kept.append(line[:max(int((budget - 1) * CHARS_PER_TOKEN), 0)])
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept + ["..."])
+
+
+def enclosing_block(code, line):
+    """(первая, последняя строка) самой вложенной функции или класса вокруг строки, или None"""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None  # T-Code с командами не всегда разбирается как Python
+    best = None
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+        end = node.end_lineno
+        if start <= line <= end and (best is None or end - start < best[1] - best[0]):
+            best = (start, end)
+    return best
+
+
+def window_around(lines, line, budget):
+    """(первая, последняя строка) окна вокруг строки, расширяемого поочередно вверх и вниз"""
+    first = last = min(max(line, 1), len(lines))
+    used = estimate_tokens(lines[first - 1] + "\n") if lines else 0
+    while first > 1 or last < len(lines):
+        grown = False
+        for candidate in (first - 1, last + 1):
+            if 1 <= candidate <= len(lines) and not first <= candidate <= last:
+                cost = estimate_tokens(lines[candidate - 1] + "\n")
+                if used + cost > budget:
+                    continue
+                used += cost
+                first, last = min(first, candidate), max(last, candidate)
+                grown = True
+        if not grown:
+            break
+    return first, last
+
+
+def build_context(code, cursor_line=1, selection="", errors=(), budget=1024):
+    """Контекст запроса: выделение, блок вокруг курсора и последние ошибки в пределах бюджета токенов"""
+    if estimate_tokens(code) <= budget and not selection and not errors:
+        return code  # весь файл помещается - отдаем как есть
+
+    parts = []
+    remaining = budget
+
+    if selection.strip():
+        # Выделение - самое явное указание пользователя, оно идет первым
+        text = trim_to_budget(selection, remaining * 2 // 3)
+        parts.append(f"Выделенный фрагмент:\n{text}")
+        remaining -= estimate_tokens(text)
+
+    if errors:
+        text = trim_to_budget("\n".join(errors), max(remaining // 4, 0))
+        if text and text != "...":
+            errors_part = f"Последние ошибки выполнения:\n{text}"
+            remaining -= estimate_tokens(text)
+        else:
+            errors_part = None
+    else:
+        errors_part = None
+
+    lines = code.splitlines()
+    if lines and remaining > 0:
+        if estimate_tokens(code) <= remaining:
+            parts.append(code)
+        else:
+            block = enclosing_block(code, cursor_line)
+            if block is not None:
+                first, last = block
+                text = trim_to_budget("\n".join(lines[first - 1:last]), remaining)
+            else:
+                first, last = window_around(lines, cursor_line, remaining)
+                # Окно всегда включает строку курсора, даже если она одна не помещается в бюджет
+                text = trim_to_budget("\n".join(lines[first - 1:last]), remaining)
+            parts.append(f"Фрагмент кода (строки {first}-{last} из {len(lines)}):\n{text}")
+
+    if errors_part:
+        parts.append(errors_part)
+    return "\n\n".join(parts)
+
+
+class Conversation:
+    """Память диалога: токены context от Ollama и скользящая сжатая история реплик"""
+
+    def __init__(self, max_turns=6, max_tokens=1536, summary_tokens=300):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens  # длина context, после которой диалог продолжается по истории
+        self.summary_tokens = summary_tokens
+        self.turns = []  # [(вопрос, ответ)]
+        self.tokens = None  # context последнего ответа - уже обработанный моделью префикс
+        self.code = None  # код, переданный модели в последнем запросе
+        self.model = None  # модель, которой принадлежит context
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        """(context, код, модель, сжатая история) для нового запроса"""
+        with self.lock:
+            if self.tokens is not None:
+                return self.tokens, self.code, self.model, ""
+            return None, None, None, self.summary()
+
+    def add_turn(self, question, answer, tokens, code, model=None):
+        with self.lock:
+            self.turns.append((question, answer))
+            del self.turns[:-self.max_turns]
+            # Слишком длинный context вытеснил бы код из окна модели - дальше идем по сжатой истории
+            if tokens and len(tokens) <= self.max_tokens:
+                self.tokens, self.code, self.model = tokens, code, model
+            else:
+                self.tokens, self.code, self.model = None, None, None
+
+    def summary(self):
+        """История текстом: последняя реплика целиком, более ранние - первой строкой"""
+        if not self.turns:
+            return ""
+        lines = []
+        for n, (question, answer) in enumerate(self.turns):
+            if n < len(self.turns) - 1:
+                question = question.strip().splitlines()[0] if question.strip() else ""
+                answer = answer.strip().splitlines()[0] if answer.strip() else ""
+            lines.append(f"Пользователь: {question}\nПомощник: {answer}")
+        # Бюджет тратится с конца: свежие реплики важнее
+        kept = []
+        used = 0
+        for text in reversed(lines):
+            cost = estimate_tokens(text)
+            if used + cost > self.summary_tokens:
+                if not kept:
+                    kept.append(trim_to_budget(text, self.summary_tokens))
+                break
+            kept.append(text)
+            used += cost
+        return "\n".join(reversed(kept))
+
+    def reset(self):
+        with self.lock:
+            self.turns = []
+            self.tokens = None
+            self.code = None
+            self.model = None
@@ -0,0 +1,214 @@
+# executor.py
+# Пул рабочих процессов для выполнения T-Code скриптов
+
+import os
+import time
+import traceback
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+try:
+    import resource  # нет в Windows - лимит памяти там не применяется
+except ImportError:
+    resource = None
+
+
+def _set_memory_limit(limit):
+    """Мягкий лимит адресного пространства процесса (байты или None)"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if limit is None:
+        resource.setrlimit(resource.RLIMIT_AS, (hard, hard))
+    else:
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _worker_main(conn):
+    """Цикл рабочего процесса: свое пространство имен для каждой вкладки"""
+    import compile as c
+
+    namespaces = {}
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        job_id, tab_key, code, memory_limit = job
+        # execute_python_code и команды работают с c.variables
+        c.variables = namespaces.setdefault(tab_key, {})
+        _set_memory_limit(memory_limit)
+        try:
+            for result in c.t_compile(code, stream=True):
+                kind = "output_error" if isinstance(result, c.ErrorResult) else "output"
+                conn.send((job_id, kind, str(result)))
+            conn.send((job_id, "done", None))
+        except Exception:
+            conn.send((job_id, "output_error", f"Ошибка выполнения: {traceback.format_exc(limit=1)}"))
+            conn.send((job_id, "done", None))
+        finally:
+            _set_memory_limit(None)
+
+
+class _Worker:
+    """Рабочий процесс и его канал связи"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.job_id = None
+        self.started = None
+        self.tabs = set()
+
+    def stop(self):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=1)
+            if self.process.is_alive():
+                self.process.kill()
+
+
+class ScriptPool:
+    """Выполнение t_compile в пуле процессов с лимитами времени и памяти"""
+
+    def __init__(self, workers=None, time_limit=None, memory_limit=None):
+        self.context = multiprocessing.get_context("spawn")
+        self.size = workers or os.cpu_count() or 1
+        self.time_limit = time_limit  # секунды на задачу
+        self.memory_limit = memory_limit  # байты на процесс
+        self.workers = []
+        self.affinity = {}  # вкладка -> рабочий процесс с её переменными
+        self.pending = deque()  # задачи, ждущие свободного процесса
+        self.events = {}  # job_id -> список (вид, данные); output_error - вывод, сообщающий об ошибке
+        self.next_id = 0
+
+    def submit(self, tab_key, code):
+        """Постановка скрипта вкладки в очередь, возвращает id задачи"""
+        self.next_id += 1
+        job_id = self.next_id
+        self.events[job_id] = []
+        self.pending.append((job_id, tab_key, code))
+        self._dispatch()
+        return job_id
+
+    def _worker_for(self, tab_key):
+        worker = self.affinity.get(tab_key)
+        if worker is None:
+            if len(self.workers) < self.size:
+                worker = _Worker(self.context)
+                self.workers.append(worker)
+            else:
+                worker = min(self.workers, key=lambda w: (w.job_id is not None, len(w.tabs)))
+            worker.tabs.add(tab_key)
+            self.affinity[tab_key] = worker
+        return worker
+
+    def _dispatch(self):
+        """Отправка ожидающих задач свободным процессам"""
+        waiting = deque()
+        replaced = set()  # задачи, для которых уже заменяли умерший процесс
+        while self.pending:
+            job_id, tab_key, code = self.pending.popleft()
+            worker = self._worker_for(tab_key)
+            if worker.job_id is not None:
+                waiting.append((job_id, tab_key, code))
+                continue
+            try:
+                if not worker.process.is_alive():
+                    raise BrokenPipeError("рабочий процесс завершился")
+                worker.conn.send((job_id, tab_key, code, self.memory_limit))
+            except OSError:
+                # Процесс умер в простое (OOM killer, упавший поток скрипта) - задача уходит новому
+                self._restart(worker, None, None)
+                if job_id in replaced:
+                    self.events.setdefault(job_id, []).extend(
+                        [("output_error", "Не удалось запустить рабочий процесс"), ("error", None)])
+                else:
+                    replaced.add(job_id)
+                    self.pending.appendleft((job_id, tab_key, code))
+                continue
+            worker.job_id = job_id
+            worker.started = time.monotonic()
+        self.pending = waiting
+
+    def collect(self):
+        """Неблокирующий сбор результатов из каналов и проверка лимитов"""
+        conns = {w.conn: w for w in self.workers if w.job_id is not None}
+        for conn in wait(list(conns), timeout=0) if conns else ():
+            worker = conns[conn]
+            try:
+                while conn.poll():
+                    job_id, kind, payload = conn.recv()
+                    self.events.setdefault(job_id, []).append((kind, payload))
+                    if kind == "done":
+                        worker.job_id = None
+                        worker.started = None
+            except (EOFError, OSError):
+                # Процесс упал - изолируем сбой только этой задачей
+                self._restart(worker, "error", "Рабочий процесс аварийно завершился")
+
+        if self.time_limit:
+            now = time.monotonic()
+            for worker in list(self.workers):
+                if worker.job_id is not None and now - worker.started > self.time_limit:
+                    self._restart(worker, "timeout", f"Превышен лимит времени ({self.time_limit} с)")
+
+        self._dispatch()
+
+    def take(self, job_id):
+        """Забирает накопленные события задачи"""
+        events = self.events.get(job_id, [])
+        if events:
+            self.events[job_id] = []
+        if any(kind not in ("output", "output_error") for kind, _ in events):
+            self.events.pop(job_id, None)
+        return events
+
+    def cancel(self, job_id):
+        """Отмена задачи: из очереди или остановкой её процесса"""
+        for item in self.pending:
+            if item[0] == job_id:
+                self.pending.remove(item)
+                self.events.pop(job_id, None)
+                return True
+        for worker in self.workers:
+            if worker.job_id == job_id:
+                self._restart(worker, None, None)
+                self.events.pop(job_id, None)
+                return True
+        return False
+
+    def _restart(self, worker, kind, message):
+        """Замена зависшего или упавшего процесса; переменные его вкладок теряются"""
+        job_id = worker.job_id
+        worker.stop()
+        self.workers.remove(worker)
+        for tab_key in worker.tabs:
+            self.affinity.pop(tab_key, None)
+        if kind and job_id is not None:
+            events = self.events.setdefault(job_id, [])
+            events.append(("output_error", message))
+            events.append((kind, None))
+
+    def shutdown(self):
+        for worker in self.workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.stop()
+        self.workers.clear()
+        self.affinity.clear()
+        self.pending.clear()
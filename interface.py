@@ -1,13 +1,28 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
+from tkinter import font as tkfont
 import webbrowser
 import os
 import re
 import compile as c
 import mcmd as cmd
-import requests
+from executor import ScriptPool
+from storage import SaveQueue, EditJournal
+import transport
+from cache import ResponseCache, response_key
+from context import build_context, Conversation
+from backends import (BACKENDS, load_config, save_config, validate_config, create_backend, route_model,
+                      parse_duration)
 import json
 import threading
+import queue
+import ctypes
+import mmap
+import codecs
+import bisect
+import heapq
+from array import array
+from collections import deque
 from datetime import datetime
 import time
 import subprocess
@@ -15,9 +30,68 @@ import subprocess
 i = 0
 
 # === Константы для ИИ-агента ===
-OLLAMA_URL = "http://localhost:11434/api/generate"
-MODEL = "tinyllama"
-REQUEST_TIMEOUT = 90
+# Сервер, модель и ее параметры задаются в настройках (backends.CONFIG_PATH)
+CONNECT_TIMEOUT = 5  # секунд на подключение к серверу модели
+REQUEST_TIMEOUT = 90  # секунд ожидания данных от модели
+AI_POOL_SIZE = 4  # постоянных соединений с сервером модели
+AI_RETRIES = 2  # повторов при сбое подключения или ответе 502/503/504
+AI_RETRY_BACKOFF = 0.5  # секунд, пауза растет вдвое с каждым повтором
+GENERATION_OPTIONS = {
+    "temperature": 0.3,
+    "top_p": 0.9,
+    "max_tokens": 500,
+    "stop": ["Пользователь:", "User:", "Human:"],
+    "repeat_penalty": 1.1
+}
+
+# === Прогрев модели ===
+AI_WARMUP_TIMEOUT = 300  # секунд на загрузку модели с диска
+AI_ACTIVITY_CHECK = 30000  # мс между проверками активности пользователя
+AI_IDLE_UNLOAD = 30 * 60  # секунд без действий пользователя до выгрузки модели
+
+# === Контекст запросов к ИИ ===
+AI_CONTEXT_TOKENS = 1024  # бюджет кода в промпте; у tinyllama окно 2048 токенов
+AI_CONTEXT_ERRORS = 5  # последних ошибок выполнения в контексте
+
+# === Память диалога ===
+AI_HISTORY_TURNS = 6  # реплик в сжатой истории
+AI_HISTORY_TOKENS = 1536  # длина context от Ollama, после которой диалог идет по сжатой истории
+AI_HISTORY_SUMMARY_TOKENS = 300  # бюджет сжатой истории в промпте
+
+# === Очередь запросов к ИИ ===
+AI_CONCURRENCY = 1  # одновременных запросов, по числу слотов сервера (OLLAMA_NUM_PARALLEL)
+AI_QUEUE_LIMIT = 8  # запросов в очереди сверх выполняемых
+PRIORITY_INTERACTIVE = 0  # вопросы из чата
+PRIORITY_BACKGROUND = 1  # анализ кода
+
+# === Чат ===
+CHAT_MAX_RENDERED = 200  # сообщений в виджете чата; более ранние остаются в chat_messages
+
+# === Кэш ответов ИИ ===
+AI_CACHE_SIZE = 128  # ответов в памяти
+AI_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".tcode", "ai_cache")  # None - без диска
+AI_CACHE_DISK_LIMIT = 50 * 1024 * 1024  # байт на диске
+AI_CACHE_TTL = 7 * 24 * 3600  # секунд
+STREAM_RESPONSES = True  # ответ выводится в чат по мере генерации
+STREAM_FLUSH_INTERVAL = 50  # мс между пачками токенов в чате
+
+# === Большие файлы ===
+LARGE_FILE_SIZE = 2 * 1024 * 1024  # байт: выше - загрузка частями в простое
+PLAIN_VIEW_SIZE = 20 * 1024 * 1024  # байт: выше - только чтение, без подсветки
+VIEWER_FILE_SIZE = 200 * 1024 * 1024  # байт: выше - просмотрщик LogViewer вместо редактора
+LOAD_CHUNK_SIZE = 256 * 1024  # байт за один шаг загрузки
+VIEWER_LINE_LIMIT = 4096  # байт строки, выводимых просмотрщиком; остаток обрезается
+VIEWER_SEARCH_WINDOW = 1024 * 1024  # байт файла за один шаг поиска
+VIEWER_SEARCH_OVERLAP = 64 * 1024  # байт перекрытия окон: совпадения длиннее на стыке не находятся
+
+# === Журнал несохраненных правок ===
+JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".tcode", "journal")
+
+# === Выполнение кода ===
+RUN_BACKEND = "process"  # "process" - пул процессов, "thread" - поток внутри IDE
+RUN_WORKERS = None  # None - по числу ядер
+RUN_TIME_LIMIT = None  # секунд на запуск, None - без ограничения
+RUN_MEMORY_LIMIT = None  # байт на рабочий процесс, None - без ограничения
 
 # Упрощенный системный промпт
 SYSTEM_PROMPT = """Ты - помощник программиста. Отвечай четко и по делу."""
@@ -28,12 +102,54 @@ def process_content(content):
     return content.replace('**', '').replace('*', '').strip()
 
 
+class FrameScheduler:
+    """Слияние событий редактора: каждая задача выполняется не чаще раза за кадр"""
+
+    FRAME_INTERVAL = 16  # мс, около 60 кадров в секунду
+    IDLE_DELAY = 120  # мс тишины перед отложенной тяжелой работой
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.pending = {}  # ключ -> функция на ближайший кадр
+        self.frame_id = None
+        self.idle_jobs = {}  # ключ -> id таймера отложенной задачи
+
+    def request(self, key, func):
+        """Задача на ближайший кадр; повторные запросы с тем же ключом сливаются"""
+        self.pending[key] = func
+        if self.frame_id is None:
+            self.frame_id = self.widget.after(self.FRAME_INTERVAL, self._run_frame)
+
+    def request_idle(self, key, func, delay=None):
+        """Отложенная задача: выполняется в простое, когда события затихли"""
+        after_id = self.idle_jobs.pop(key, None)
+        if after_id is not None:
+            self.widget.after_cancel(after_id)
+        self.idle_jobs[key] = self.widget.after(
+            self.IDLE_DELAY if delay is None else delay,
+            lambda: self._run_idle(key, func))
+
+    def _run_frame(self):
+        self.frame_id = None
+        jobs, self.pending = self.pending, {}
+        for func in jobs.values():
+            try:
+                func()
+            except tk.TclError:
+                pass  # виджет мог быть уничтожен
+
+    def _run_idle(self, key, func):
+        self.idle_jobs.pop(key, None)
+        self.widget.after_idle(func)
+
+
 class LineNumbers(tk.Canvas):
     """Класс для отображения номеров строк"""
 
-    def __init__(self, parent, text_widget, **kwargs):
+    def __init__(self, parent, text_widget, scheduler=None, **kwargs):
         super().__init__(parent, **kwargs)
         self.text_widget = text_widget
+        self.scheduler = scheduler
         self.configure(
             width=50,
             bg="#2d2d2d",
@@ -41,69 +157,599 @@ class LineNumbers(tk.Canvas):
             borderwidth=0
         )
 
-        # Привязка событий для синхронизации
-        self.text_widget.bind('<KeyRelease>', self.redraw)
-        self.text_widget.bind('<Button-1>', self.redraw)
-        self.text_widget.bind('<MouseWheel>', self.redraw)
-        self.text_widget.bind('<Configure>', self.redraw)
+        # Пул текстовых элементов canvas: элементы переиспользуются между перерисовками
+        self.items = []
+        self.item_state = []  # (текст, y) для каждого элемента пула; None - скрыт
 
-        self.cmd_running = False
+        # Прокрутка отслеживается через yscrollcommand, а не по событиям мыши
+        self.scroll_listeners = []
+        self.text_widget.config(yscrollcommand=self.on_yscroll)
 
-        # Привязка прокрутки
-        self.text_widget.bind('<B1-Motion>', self.redraw)
+        # Правки без прокрутки (новая строка) и изменение размера
+        for sequence in ('<KeyRelease>', '<Configure>'):
+            self.text_widget.bind(sequence, self.request_redraw, add="+")
 
-    def redraw(self, event=None):
-        """Перерисовка номеров строк"""
-        self.delete("all")
+        self.cmd_running = False
 
-        # Получаем первую видимую строку
-        first_line = self.text_widget.index("@0,0")
+    def on_yscroll(self, first, last):
+        """yscrollcommand текстового виджета: уведомляет слушателей и перерисовывает номера"""
+        for listener in self.scroll_listeners:
+            listener(first, last)
+        self.request_redraw()
 
-        # Получаем информацию о видимых строках
-        line_num = int(first_line.split('.')[0])
+    def request_redraw(self, event=None):
+        """Перерисовка не чаще раза за кадр"""
+        if self.scheduler is None:
+            self.redraw()
+        else:
+            self.scheduler.request((self, "redraw"), self.redraw)
 
-        # Рисуем номера для всех видимых строк
-        y_pos = 0
-        while True:
-            try:
-                # Получаем информацию о строке
-                dline_info = self.text_widget.dlineinfo(f"{line_num}.0")
-                if dline_info is None:
-                    break
+    def redraw(self, event=None):
+        """Перерисовка номеров строк с обновлением только изменившихся элементов"""
+        try:
+            first_line = int(self.text_widget.index("@0,0").split('.')[0])
+            last_line = int(self.text_widget.index(f"@0,{self.text_widget.winfo_height()}").split('.')[0])
+            # При wrap='none' все строки одной высоты - достаточно одного dlineinfo
+            dline_info = self.text_widget.dlineinfo(f"{first_line}.0")
+        except tk.TclError:
+            return
 
-                # Позиция строки относительно виджета
-                line_y = dline_info[1]
+        lines = []
+        if dline_info is not None:
+            top, height = dline_info[1], dline_info[3]
+            lines = [(str(line_num), top + (line_num - first_line) * height + height // 2)
+                     for line_num in range(first_line, last_line + 1)]
 
-                # Рисуем номер строки
-                self.create_text(
-                    45, line_y + 10,  # Выравнивание по правому краю
+        for idx, state in enumerate(lines):
+            if idx == len(self.items):
+                self.items.append(self.create_text(
+                    45, state[1],  # Выравнивание по правому краю
                     anchor="e",
-                    text=str(line_num),
+                    text=state[0],
                     fill="#858585",
                     font=("Consolas", 10)
-                )
+                ))
+                self.item_state.append(state)
+                continue
+
+            old_state = self.item_state[idx]
+            if old_state == state:
+                continue
+            item = self.items[idx]
+            if old_state is None:
+                self.itemconfigure(item, state="normal")
+            if old_state is None or old_state[0] != state[0]:
+                self.itemconfigure(item, text=state[0])
+            if old_state is None or old_state[1] != state[1]:
+                self.coords(item, 45, state[1])
+            self.item_state[idx] = state
+
+        # Лишние элементы скрываются, а не удаляются
+        for idx in range(len(lines), len(self.items)):
+            if self.item_state[idx] is not None:
+                self.itemconfigure(self.items[idx], state="hidden")
+                self.item_state[idx] = None
+
+
+class TextProxy:
+    """Перехват insert/delete у tk.Text: слушатели получают каждую правку, в том числе при undo"""
+
+    def __init__(self, text_widget):
+        self.text = text_widget
+        self.listeners = []  # listener(kind, start, arg)
+        widget = str(text_widget)
+        self._orig = widget + "_orig"
+        text_widget.tk.call("rename", widget, self._orig)
+        text_widget.tk.createcommand(widget, self._proxy)
+
+    def _notify(self, kind, start, arg):
+        for listener in self.listeners:
+            listener(kind, start, arg)
+
+    def _proxy(self, command, *args):
+        call = self.text.tk.call
+        if command == "insert" and len(args) >= 2:
+            start = str(call(self._orig, "index", args[0]))
+            result = call(self._orig, command, *args)
+            self._notify("insert", start, "".join(str(chars) for chars in args[1::2]))
+            return result
+        if command in ("delete", "replace") and args:
+            start = str(call(self._orig, "index", args[0]))
+            end = str(call(self._orig, "index", args[1] if len(args) > 1 else f"{args[0]} +1c"))
+            result = call(self._orig, command, *args)
+            self._notify("delete", start, end)
+            if command == "replace":
+                self._notify("insert", start, "".join(str(chars) for chars in args[2::2]))
+            return result
+        return call(self._orig, command, *args)
+
+
+class TCodeLexer:
+    """Построчный лексер T-Code: состояние в конце строки хранит незакрытую тройную строку"""
+
+    NORMAL, TRIPLE_SINGLE, TRIPLE_DOUBLE = 0, 1, 2
+
+    # Группы слов; при пересечении побеждает группа ниже (как и приоритет тегов)
+    WORDS = [
+        ("keyword", "False True and as assert async await break continue del except finally range "
+                    "global lambda nonlocal pass raise return try with yield"),
+        ("symbols", "neural layer PiCore delta var"),
+        ("important", "import from return or not None in is"),
+        ("funct", "print input def if else elif class for while"),
+    ]
+
+    TOKEN_RE = re.compile(r"""
+        (?P<comment>\#.*)
+      | (?P<triple>[rRbBuUfF]{0,2}(?:'''|\"\"\"))
+      | (?P<string>[rRbBuUfF]{0,2}(?:"(?:[^"\\]|\\.)*"?|'(?:[^'\\]|\\.)*'?))
+      | (?P<name>[A-Za-z_]\w*)
+    """, re.VERBOSE)
+
+    COMMAND_RE = re.compile(r"^(\s*)(!\s*[\w.]+)(?=\s*\()")
+
+    CLOSERS = {
+        TRIPLE_SINGLE: re.compile(r"(?:\\.|[^\\])*?'''"),
+        TRIPLE_DOUBLE: re.compile(r'(?:\\.|[^\\])*?"""'),
+    }
 
-                line_num += 1
+    def __init__(self):
+        self.word_classes = {}
+        for tag, words in self.WORDS:
+            for word in words.split():
+                self.word_classes[word] = tag
+
+    def lex_line(self, line, state=NORMAL, command_names=()):
+        """Разбор строки -> (список (тег, начало, конец), состояние в конце строки)"""
+        tokens = []
+        pos = 0
+
+        if state != self.NORMAL:
+            match = self.CLOSERS[state].match(line)
+            if not match:
+                tokens.append(("string", 0, len(line)))
+                return tokens, state
+            tokens.append(("string", 0, match.end()))
+            pos = match.end()
+            state = self.NORMAL
+        else:
+            # Команды T-Code (!var.create(...)) - только в начале строки
+            match = self.COMMAND_RE.match(line)
+            if match and re.sub(r"\s+", "", match.group(2))[1:] in command_names:
+                tokens.append(("command", match.start(2), match.end(2)))
+                pos = match.end(2)
+
+        while pos < len(line):
+            match = self.TOKEN_RE.search(line, pos)
+            if not match:
+                break
+            kind = match.lastgroup
+            start, end = match.span()
+            if kind == "triple":
+                delimiter = line[end - 3:end]
+                inner_state = self.TRIPLE_SINGLE if delimiter == "'''" else self.TRIPLE_DOUBLE
+                closing = self.CLOSERS[inner_state].match(line, end)
+                if not closing:
+                    tokens.append(("string", start, len(line)))
+                    return tokens, inner_state
+                end = closing.end()
+                tokens.append(("string", start, end))
+            elif kind == "name":
+                tag = self.word_classes.get(match.group())
+                if tag:
+                    tokens.append((tag, start, end))
+            else:
+                tokens.append((kind, start, end))
+            pos = end
+
+        return tokens, state
+
+    def end_state(self, line, state=NORMAL):
+        """Только состояние в конце строки (без сбора токенов)"""
+        return self.lex_line(line, state)[1]
+
+
+class SyntaxHighlighter:
+    """Инкрементальная подсветка: пересканируются только измененные строки и видимая область"""
+
+    # Порядок важен: теги, созданные позже, имеют больший приоритет
+    TAGS = [
+        ("keyword", "#6b5aef"),
+        ("symbols", "#e45b53"),
+        ("important", "#14a5e3"),
+        ("funct", "#d69a56"),
+        ("command", "#c586c0"),
+        ("string", "#9ace78"),
+        ("comment", "#696969"),
+    ]
+
+    lexer = TCodeLexer()
+
+    def __init__(self, text_widget, proxy=None, scheduler=None):
+        self.text = text_widget
+        self.scheduler = scheduler
+        self.dirty = set()
+        self.line_count = self._line_count()
+        # states[n] - состояние лексера в конце строки n + 1; известно для префикса документа
+        self.states = array('B')
+
+        # Теги настраиваются один раз на редактор
+        for tag, color in self.TAGS:
+            self.text.tag_configure(tag, foreground=color)
+
+        # Точные диапазоны правок (и при undo) приходят от перехватчика команд виджета
+        self.proxy = proxy or TextProxy(text_widget)
+        self.proxy.listeners.append(self.on_change)
+
+    def on_change(self, kind, start, arg):
+        """Слушатель TextProxy: insert - arg это текст, delete - arg это конец диапазона"""
+        if kind == "insert":
+            self.on_insert(self._line_of(start), arg.count("\n"))
+        else:
+            self.on_delete(self._line_of(start), self._line_of(arg))
+        self.request_highlight()
+
+    @staticmethod
+    def _line_of(index):
+        return int(str(index).split('.')[0])
+
+    def _line_count(self):
+        return int(self.text.index("end-1c").split('.')[0])
+
+    def _visible_lines(self):
+        first = int(self.text.index("@0,0").split('.')[0])
+        last = int(self.text.index(f"@0,{self.text.winfo_height()}").split('.')[0])
+        return first, last
+
+    def mark_dirty(self, first, last):
+        self.dirty.update(range(first, last + 1))
+
+    def on_insert(self, line, added):
+        """Вставка added переводов строк в строку line"""
+        if added:
+            self.dirty = {n if n <= line else n + added for n in self.dirty}
+            # Конец бывшей строки line теперь - конец строки line + added
+            if line - 1 < len(self.states):
+                self.states[line - 1:line - 1] = array('B', bytes(added))
+        self.mark_dirty(line, line + added)
+
+    def on_delete(self, first, last):
+        """Удаление текста со строки first по строку last (строки сливаются в first)"""
+        removed = last - first
+        if removed:
+            self.dirty = {n if n <= first else max(first, n - removed) for n in self.dirty}
+            # Конец новой строки first - это конец бывшей строки last
+            del self.states[first - 1:last - 1]
+        self.mark_dirty(first, first)
+
+    def request_highlight(self, idle=False):
+        """Подсветка через планировщик: правки - в ближайший кадр, прокрутка - в простое"""
+        if self.scheduler is None:
+            self.highlight()
+        elif idle:
+            self.scheduler.request_idle((self, "highlight"), self.highlight)
+        else:
+            self.scheduler.request((self, "highlight"), self.highlight)
 
-                # Проверяем, не вышли ли за пределы видимой области
-                if line_y > self.text_widget.winfo_height():
-                    break
+    def _state_before(self, line):
+        return self.states[line - 2] if line > 1 else TCodeLexer.NORMAL
 
-            except tk.TclError:
-                break
+    def _relex_from(self, first, last):
+        """Пересчет состояний от first до схождения с кэшем (не раньше last)"""
+        if first > len(self.states):
+            return
+        line = first
+        state = self._state_before(first)
+        while line <= len(self.states):
+            state = self.lexer.end_state(self.text.get(f"{line}.0", f"{line}.end"), state)
+            if line >= last and self.states[line - 1] == state:
+                return
+            self.states[line - 1] = state
+            line += 1
+
+    def _ensure_states(self, last):
+        """Досчет состояний для строк, до которых подсветка еще не доходила"""
+        last = min(last, self.line_count)
+        line = len(self.states) + 1
+        if line > last:
+            return
+        state = self._state_before(line)
+        for text in self.text.get(f"{line}.0", f"{last}.end").split("\n"):
+            state = self.lexer.end_state(text, state)
+            self.states.append(state)
+
+    def highlight(self, full=False):
+        """Подсветка грязных строк и видимой области"""
+        if full:
+            self.line_count = self._line_count()
+            del self.states[:]
+            lines = set(range(1, self.line_count + 1))
+        else:
+            self.line_count = self._line_count()
+            del self.states[self.line_count:]
+            if self.dirty:
+                self._relex_from(min(self.dirty), max(self.dirty))
+            first, last = self._visible_lines()
+            lines = self.dirty | set(range(first, last + 1))
+        self.dirty = set()
+
+        lines = {n for n in lines if n <= self.line_count}
+        if not lines:
+            return
+        self._ensure_states(max(lines))
+        for first, last in self._ranges(lines):
+            self._highlight_range(first, last)
+
+    @staticmethod
+    def _ranges(lines):
+        """Свертка набора номеров строк в непрерывные диапазоны"""
+        ranges = []
+        for line in sorted(lines):
+            if ranges and line == ranges[-1][1] + 1:
+                ranges[-1][1] = line
+            else:
+                ranges.append([line, line])
+        return ranges
+
+    def _highlight_range(self, first, last):
+        start = f"{first}.0"
+        end = f"{last}.end"
+
+        for tag, _ in self.TAGS:
+            self.text.tag_remove(tag, start, end)
+
+        command_names = {name for name, cmd in c.commands.items() if cmd.start == '!'}
+        indices = {tag: [] for tag, _ in self.TAGS}
+        state = self._state_before(first)
+        for line, text in enumerate(self.text.get(start, end).split("\n"), first):
+            tokens, state = self.lexer.lex_line(text, state, command_names)
+            for tag, token_start, token_end in tokens:
+                indices[tag].append(f"{line}.{token_start}")
+                indices[tag].append(f"{line}.{token_end}")
+
+        # Один вызов tag_add на все токены тега
+        for tag, tag_indices in indices.items():
+            if tag_indices:
+                self.text.tag_add(tag, *tag_indices)
+
+
+class LogViewer(tk.Frame):
+    """Просмотр огромных файлов только для чтения: mmap и индекс начал строк"""
+
+    SCROLL_LINES = 3
+
+    def __init__(self, parent, filepath, colors, scheduler=None):
+        super().__init__(parent, bg=colors["editor_bg"])
+        self.filepath = filepath
+        self.colors = colors
+        self.scheduler = scheduler
+        self.size = os.path.getsize(filepath)
+
+        self.file = open(filepath, "rb")
+        # mmap не умеет отображать пустой файл
+        self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+
+        # offsets[n] - смещение начала строки n + 1; 8 байт на строку - вся память просмотрщика
+        self.offsets = array('Q', [0])
+        self.index_done = False
+        self.top = 0  # первая видимая строка, с нуля
+        self.current_line = None
+        self.search_pos = 0
+        self.searching = False
+        self.closed = False
+
+        self.create_widgets()
+        threading.Thread(target=self._build_index, daemon=True).start()
+        self.after(200, self._poll_index)
 
-        # Планируем следующую перерисовку через небольшую задержку
-        self.after_idle(self.sync_scroll)
+    def create_widgets(self):
+        toolbar = tk.Frame(self, bg=self.colors["editor_bg"])
+        toolbar.pack(fill=tk.X, padx=8, pady=(8, 0))
+
+        tk.Label(toolbar, text="Строка:", bg=self.colors["editor_bg"], fg="#d4d4d4",
+                 font=("Segoe UI", 9)).pack(side=tk.LEFT)
+        self.line_entry = tk.Entry(toolbar, width=10, bg=self.colors["input_bg"], fg="#d4d4d4",
+                                   insertbackground="#d4d4d4", relief="flat")
+        self.line_entry.pack(side=tk.LEFT, padx=(4, 12))
+        self.line_entry.bind("<Return>", lambda e: self.jump_to_line())
+
+        tk.Label(toolbar, text="Поиск (regex):", bg=self.colors["editor_bg"], fg="#d4d4d4",
+                 font=("Segoe UI", 9)).pack(side=tk.LEFT)
+        self.search_entry = tk.Entry(toolbar, width=30, bg=self.colors["input_bg"], fg="#d4d4d4",
+                                     insertbackground="#d4d4d4", relief="flat")
+        self.search_entry.pack(side=tk.LEFT, padx=(4, 4))
+        self.search_entry.bind("<Return>", lambda e: self.search())
+
+        tk.Button(toolbar, text="Найти далее", bg=self.colors["btn_normal"], fg="#d4d4d4",
+                  font=("Segoe UI", 8), relief="flat", borderwidth=0,
+                  command=self.search).pack(side=tk.LEFT, padx=4)
+
+        self.status = tk.Label(toolbar, text="", bg=self.colors["editor_bg"], fg="#858585",
+                               font=("Segoe UI", 9))
+        self.status.pack(side=tk.RIGHT)
+
+        body = tk.Frame(self, bg=self.colors["editor_bg"])
+        body.pack(fill=tk.BOTH, expand=True, padx=8, pady=8)
+
+        self.font = tkfont.Font(family="Consolas", size=11)
+        self.text = tk.Text(body, wrap='none', font=self.font,
+                            background=self.colors["editor_bg"], foreground=self.colors["editor_fg"],
+                            selectbackground="#264f78", relief="flat", padx=12, pady=12,
+                            borderwidth=0, state="disabled")
+        self.text.tag_configure("lineno", foreground="#858585")
+        self.text.tag_configure("current", background="#264f78")
+        self.text.tag_configure("match", background="#6b5a1e")
+
+        self.scrollbar = tk.Scrollbar(body, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # Прокрутка управляется просмотрщиком: в виджете только видимое окно строк
+        self.text.bind("<MouseWheel>", lambda e: self.scroll(-self.SCROLL_LINES if e.delta > 0 else self.SCROLL_LINES))
+        self.text.bind("<Button-4>", lambda e: self.scroll(-self.SCROLL_LINES))
+        self.text.bind("<Button-5>", lambda e: self.scroll(self.SCROLL_LINES))
+        self.text.bind("<Up>", lambda e: self.scroll(-1))
+        self.text.bind("<Down>", lambda e: self.scroll(1))
+        self.text.bind("<Prior>", lambda e: self.scroll(-self.visible_rows()))
+        self.text.bind("<Next>", lambda e: self.scroll(self.visible_rows()))
+        self.text.bind("<Configure>", lambda e: self.request_render())
+
+    def _build_index(self):
+        """Один проход по файлу в фоне; индекс пополняется по мере чтения"""
+        mapped = self.mapped
+        offsets = self.offsets
+        find = mapped.find
+        pos = find(b"\n")
+        while pos != -1:
+            if pos + 1 < self.size:
+                offsets.append(pos + 1)
+            pos = find(b"\n", pos + 1)
+        self.index_done = True
+
+    def _poll_index(self):
+        self.request_render()
+        if not self.index_done:
+            self.after(200, self._poll_index)
+
+    def line_count(self):
+        return len(self.offsets)
+
+    def visible_rows(self):
+        return max(1, self.text.winfo_height() // self.font.metrics("linespace"))
+
+    def line_bytes(self, line):
+        """(содержимое строки с нуля без перевода строки, обрезана ли она по VIEWER_LINE_LIMIT)"""
+        start = self.offsets[line]
+        end = self.offsets[line + 1] - 1 if line + 1 < len(self.offsets) else self.size
+        if not self.index_done and line + 1 >= len(self.offsets):
+            end = self.size  # хвост индекса еще строится
+        truncated = end - start > VIEWER_LINE_LIMIT
+        data = self.mapped[start:min(end, start + VIEWER_LINE_LIMIT)]
+        if not truncated and data.endswith(b"\r"):
+            data = data[:-1]
+        return data, truncated
+
+    def request_render(self):
+        if self.scheduler is None:
+            self.render()
+        else:
+            self.scheduler.request((self, "render"), self.render)
+
+    def render(self):
+        """Отрисовка только видимого окна строк"""
+        total = self.line_count()
+        rows = self.visible_rows()
+        self.top = max(0, min(self.top, total - rows))
+        last = min(total, self.top + rows)
+        width = len(str(total))
+
+        self.text.config(state="normal")
+        self.text.delete("1.0", tk.END)
+        for row, line in enumerate(range(self.top, last), 1):
+            self.text.insert(tk.END, f"{line + 1:>{width}}  ", "lineno")
+            data, truncated = self.line_bytes(line)
+            self.text.insert(tk.END, data.decode("utf-8", errors="replace"))
+            self.text.insert(tk.END, " ...\n" if truncated else "\n", "lineno" if truncated else ())
+            if line == self.current_line:
+                self.text.tag_add("current", f"{row}.0", f"{row}.end")
+        self.text.config(state="disabled")
+
+        if total:
+            self.scrollbar.set(self.top / total, last / total)
+        suffix = "" if self.index_done else " (индексация...)"
+        self.status.config(text=f"Строки {self.top + 1}-{last} из {total}{suffix}")
+
+    def scroll(self, lines):
+        self.top += lines
+        self.request_render()
+        return "break"
 
-    def sync_scroll(self):
-        """Синхронизация прокрутки с текстовым виджетом"""
-        # Получаем текущую позицию прокрутки
+    def on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.top = int(float(value) * self.line_count())
+        elif action == "scroll":
+            step = self.visible_rows() if unit == "pages" else 1
+            self.top += int(value) * step
+        self.request_render()
+
+    def show_line(self, line):
+        """Прокрутка к строке (с нуля) с выделением"""
+        self.current_line = line
+        self.top = max(0, line - self.visible_rows() // 2)
+        self.request_render()
+
+    def jump_to_line(self):
         try:
-            top, bottom = self.text_widget.yview()
-            # Обновляем область прокрутки canvas
-            self.configure(scrollregion=self.bbox("all"))
-        except:
-            pass
+            line = int(self.line_entry.get()) - 1
+        except ValueError:
+            self.status.config(text="Введите номер строки")
+            return
+        self.show_line(max(0, min(line, self.line_count() - 1)))
+
+    def search(self):
+        """Поиск регулярного выражения по отображенному файлу (в фоне)"""
+        if self.searching or not self.size:
+            return
+        try:
+            pattern = re.compile(self.search_entry.get().encode("utf-8"), re.MULTILINE)
+        except re.error as e:
+            self.status.config(text=f"Ошибка в выражении: {e}")
+            return
+
+        if self.current_line is not None:
+            self.search_pos = max(self.search_pos, self.offsets[self.current_line])
+        self.searching = True
+        self.status.config(text="Поиск...")
+
+        def worker(start):
+            try:
+                match = self._search_range(pattern, start, self.size)
+                if match is None and start:
+                    match = self._search_range(pattern, 0, start)  # с начала файла
+            except ValueError:
+                return  # просмотрщик закрыт во время поиска, mmap уже освобожден
+            if not self.closed:
+                self.after(0, self._on_search_result, match)
+
+        threading.Thread(target=worker, args=(self.search_pos,), daemon=True).start()
+
+    def _search_range(self, pattern, start, stop):
+        """Первое совпадение, начинающееся в [start, stop), поиском по окнам VIEWER_SEARCH_WINDOW.
+        re держит GIL на все время поиска, поэтому между окнами интерфейс получает управление."""
+        mapped = self.mapped
+        pos = start
+        while pos < stop and not self.closed:
+            window_end = min(stop, pos + VIEWER_SEARCH_WINDOW)
+            # Окно продлевается на перекрытие и заканчивается на переводе строки, чтобы $ не срабатывал посреди строки
+            end = min(self.size, window_end + VIEWER_SEARCH_OVERLAP)
+            if end < self.size:
+                newline = mapped.find(b"\n", end, end + VIEWER_SEARCH_OVERLAP)
+                if newline != -1:
+                    end = newline
+            match = pattern.search(mapped, pos, end)
+            if match is not None and match.start() < window_end:
+                return match
+            pos = window_end
+            time.sleep(0)
+        return None
+
+    def _on_search_result(self, match):
+        self.searching = False
+        if match is None:
+            self.status.config(text="Совпадений нет")
+            return
+
+        line = bisect.bisect_right(self.offsets, match.start()) - 1
+        if not self.index_done and line == len(self.offsets) - 1:
+            self.status.config(text="Совпадение за пределами индекса, повторите после индексации")
+            return
+        self.search_pos = max(match.end(), match.start() + 1)
+        self.show_line(line)
+
+    def close(self):
+        self.closed = True
+        if self.size:
+            self.mapped.close()
+        self.file.close()
 
 
 class ChatMessage:
@@ -119,64 +765,165 @@ class ChatMessage:
 class AIRequestManager:
     """Менеджер для управления запросами к ИИ"""
 
-    def __init__(self, callback_func):
+    def __init__(self, callback_func, stream=STREAM_RESPONSES, cache=None,
+                 concurrency=AI_CONCURRENCY, queue_limit=AI_QUEUE_LIMIT, config=None):
         self.callback = callback_func
-        self.is_processing = False
-        self.current_thread = None
-        self.request_queue = []
-
-    def add_request(self, prompt, context=""):
-        """Добавление запроса в очередь"""
-        if self.is_processing:
+        self.warnings = []  # проблемы с файлом настроек, интерфейс показывает их в чате
+        self.config = config or load_config(warnings=self.warnings)
+        self.backend = create_backend(self.config)
+        self.stream = stream
+        self.cache = cache
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.active = {}  # id -> transport.RequestHandle выполняемых запросов
+        self.next_id = 0
+        self.session = transport.create_session(max(AI_POOL_SIZE, concurrency), AI_RETRIES, AI_RETRY_BACKOFF)
+        self.request_queue = []  # куча (приоритет, id, handle, запрос, контекст, с памятью)
+        self.conversation = Conversation(AI_HISTORY_TURNS, AI_HISTORY_TOKENS, AI_HISTORY_SUMMARY_TOKENS)
+        self.lock = threading.Lock()
+        self.last_wait = 0.0  # секунд в очереди у последнего запущенного запроса
+        self.model_state = "unknown"  # loading, ready, unloaded, error
+        self.last_used = 0.0  # время последнего обращения к модели (monotonic)
+        self.warming = False
+
+    def configure(self, config):
+        """Смена сервера и модели; следующие запросы идут уже через новый backend.
+        Неверные настройки отклоняются с ValueError, текущие остаются в силе"""
+        validate_config(config)
+        backend = create_backend(config)
+        self.config, self.backend = config, backend
+        self.conversation.reset()  # context одной модели другой не подходит
+        self.model_state = "unknown"
+
+    def warm_up(self, on_state=None, unload=False):
+        """Загрузка модели в фоне (unload=True - выгрузка); on_state(состояние, ошибка) вызывается из потока"""
+        if self.warming:
             return False
+        self.warming = True
+        backend, model = self.backend, self.config["model"]
+        keep_alive = 0 if unload else self.config["keep_alive"]
+        if not unload:
+            self.model_state = "loading"
 
-        self.is_processing = True
-        self.current_thread = threading.Thread(
-            target=self._process_request,
-            args=(prompt, context),
-            daemon=True
-        )
-        self.current_thread.start()
+        def worker():
+            try:
+                backend.warm_up(self.session, model, keep_alive, (CONNECT_TIMEOUT, AI_WARMUP_TIMEOUT))
+                state, error = ("unloaded" if unload else "ready"), None
+            except Exception as e:
+                state, error = "error", str(e)
+            self.warming = False
+            if backend is not self.backend:
+                return  # пока грузилась, настройки сменились
+            self.model_state = state
+            if state == "ready":
+                self.last_used = time.monotonic()
+            if on_state:
+                on_state(state, error)
+
+        threading.Thread(target=worker, daemon=True).start()
         return True
 
-    def _process_request(self, prompt, context):
+    @property
+    def is_processing(self):
+        return bool(self.active or self.request_queue)
+
+    def add_request(self, prompt, context="", priority=PRIORITY_INTERACTIVE, remember=False):
+        """Добавление запроса в очередь; возвращает id запроса или None, если очередь заполнена.
+        remember - запрос продолжает диалог и сам становится его частью"""
+        with self.lock:
+            if len(self.request_queue) >= self.queue_limit:
+                return None
+            self.next_id += 1
+            handle = transport.RequestHandle(self.next_id)
+            handle.enqueued = time.monotonic()
+            heapq.heappush(self.request_queue, (priority, handle.id, handle, prompt, context, remember))
+        self._dispatch()
+        return handle.id
+
+    def _dispatch(self):
+        """Запуск запросов из очереди, пока есть свободные слоты"""
+        with self.lock:
+            started = []
+            while self.request_queue and len(self.active) < self.concurrency:
+                _, _, handle, prompt, context, remember = heapq.heappop(self.request_queue)
+                self.active[handle.id] = handle
+                self.last_wait = time.monotonic() - handle.enqueued
+                started.append((handle, prompt, context, remember))
+        for handle, prompt, context, remember in started:
+            threading.Thread(
+                target=self._process_request,
+                args=(handle, prompt, context, remember),
+                daemon=True
+            ).start()
+
+    def queue_stats(self):
+        """(выполняется, в очереди, секунд ждет старейший запрос очереди)"""
+        with self.lock:
+            now = time.monotonic()
+            oldest = max((now - item[2].enqueued for item in self.request_queue), default=0.0)
+            return len(self.active), len(self.request_queue), oldest
+
+    def _process_request(self, handle, prompt, context, remember=False):
         """Обработка запроса в отдельном потоке"""
+        transport.bind(handle)
         try:
-            response = self._make_api_call(prompt, context)
-            self.callback("success", response)
+            backend = self.backend
+            tokens, sent_code, model, history = (self.conversation.snapshot() if remember
+                                                 else (None, None, None, ""))
+            if not backend.supports_context:
+                tokens = None
+            if tokens is not None:
+                # Продолжение диалога: системный промпт и уже отправленный код есть в context модели
+                final_prompt = self._build_prompt(prompt, "" if context == sent_code else context,
+                                                  followup=True)
+            else:
+                final_prompt = self._build_prompt(prompt, context, history)
+
+            if tokens is None:
+                # Самая дешевая модель, в окно которой помещаются промпт и ответ
+                model = route_model(self.config, final_prompt, GENERATION_OPTIONS["max_tokens"])
+                model_options = dict(GENERATION_OPTIONS, num_ctx=model.get("num_ctx", self.config["num_ctx"]))
+                # Ответ на продолжение диалога зависит от истории - такие запросы не кэшируются
+                key = response_key(f"{backend.name}:{model['name']}", model_options, final_prompt)
+            else:
+                key = None
+            response = self.cache.get(key) if self.cache is not None and key else None
+            if response is not None:
+                status, new_tokens = "cached", None
+            else:
+                response, new_tokens = backend.generate(
+                    self.session, handle, model, final_prompt, GENERATION_OPTIONS, tokens,
+                    stream=self.stream, on_token=lambda token: self._emit_token(handle, token),
+                    timeout=(CONNECT_TIMEOUT, REQUEST_TIMEOUT)
+                )
+                status = "success"
+                self.model_state, self.last_used = "ready", time.monotonic()
+                if self.cache is not None and key and response and not handle.cancelled:
+                    self.cache.put(key, response)
+            if remember and response and not handle.cancelled:
+                self.conversation.add_turn(prompt, response, new_tokens, context, model)
         except Exception as e:
-            self.callback("error", str(e))
+            response, status = str(e), "error"
         finally:
-            self.is_processing = False
-
-    def _make_api_call(self, prompt, context):
-        """Выполнение API запроса"""
-        final_prompt = self._build_prompt(prompt, context)
-
-        data = {
-            "model": MODEL,
-            "prompt": final_prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.3,
-                "top_p": 0.9,
-                "max_tokens": 500,
-                "stop": ["Пользователь:", "User:", "Human:"],
-                "repeat_penalty": 1.1
-            }
-        }
-
-        response = requests.post(OLLAMA_URL, json=data, timeout=REQUEST_TIMEOUT)
-
-        if response.status_code != 200:
-            raise Exception(f"API Error {response.status_code}: {response.text}")
-
-        result = response.json()
-        return result.get('response', '').strip()
-
-    def _build_prompt(self, user_prompt, context):
+            transport.bind(None)
+            handle.release()
+            with self.lock:
+                self.active.pop(handle.id, None)
+        # Ответ отмененного запроса отбрасывается
+        if not handle.cancelled:
+            self.callback(status, response, handle.id)
+        self._dispatch()
+
+    def _emit_token(self, handle, token):
+        if not handle.cancelled:
+            self.callback("token", token, handle.id)
+
+    def _build_prompt(self, user_prompt, context, history="", followup=False):
         """Построение упрощенного промпта"""
-        parts = [SYSTEM_PROMPT]
+        parts = [] if followup else [SYSTEM_PROMPT]
+
+        if history:
+            parts.append(f"\nПредыдущий разговор:\n{history}")
 
         if context:
             parts.append(f"\nВот код пользователя:\n{context}")
@@ -184,11 +931,186 @@ class AIRequestManager:
         parts.append(f"\nВот его запрос: {user_prompt}")
         parts.append("\nОтвет:")
 
-        return "\n".join(parts)
+        return "\n".join(parts).lstrip()
+
+    def cancel_request(self, request_id=None):
+        """Отмена запроса (None - всех): соединение закрывается, слот сразу освобождается"""
+        with self.lock:
+            queued = [item for item in self.request_queue if request_id in (None, item[1])]
+            for item in queued:
+                self.request_queue.remove(item)
+            heapq.heapify(self.request_queue)
+            ids = [request_id] if request_id is not None else list(self.active)
+            running = [self.active.pop(i) for i in ids if i in self.active]
+        for handle in running:
+            handle.cancel()
+        for item in queued:
+            item[2].cancel()
+        self._dispatch()
+        return bool(queued or running)
+
+
+class RunCancelled(BaseException):
+    """Исключение, которое внедряется в поток выполнения кода при отмене"""
+
+
+class CodeRunner:
+    """Фоновое выполнение кода редактора с потоковым выводом и прерыванием"""
+
+    POLL_INTERVAL = 16  # мс, около 60 кадров в секунду
+
+    def __init__(self, widget, on_output, on_finish):
+        self.widget = widget
+        self.on_output = on_output
+        self.on_finish = on_finish
+        self.thread = None
+        self.run_id = 0
+        self.results = queue.Queue()
+        self.is_running = False
+        self.cancelling = False  # прерывание запрошено, поток еще не завершился
+        self.polling = False
+
+    def start(self, code):
+        """Запуск кода в отдельном потоке"""
+        if self.is_running:
+            return False
 
-    def cancel_request(self):
-        """Отмена текущего запроса"""
-        self.is_processing = False
+        self.run_id += 1
+        self.is_running = True
+        self.thread = threading.Thread(
+            target=self._worker,
+            args=(self.run_id, code),
+            daemon=True
+        )
+        self.thread.start()
+        if not self.polling:
+            self.polling = True
+            self.widget.after(self.POLL_INTERVAL, self._poll)
+        return True
+
+    def _worker(self, run_id, code):
+        """Выполнение t_compile в потоке; результаты уходят в очередь"""
+        try:
+            for result in c.t_compile(code, stream=True):
+                kind = "output_error" if isinstance(result, c.ErrorResult) else "output"
+                self.results.put((run_id, kind, result))
+            self.results.put((run_id, "done", None))
+        except RunCancelled:
+            pass
+        except Exception as e:
+            self.results.put((run_id, "output_error", f"Ошибка выполнения: {e}"))
+            self.results.put((run_id, "done", None))
+
+    def _poll(self):
+        """Перенос результатов в интерфейс пачками, из основного потока"""
+        chunks = []
+        errors = []
+        finished = None
+        while True:
+            try:
+                run_id, kind, payload = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if run_id != self.run_id:
+                continue  # поздние результаты отмененного запуска
+            if kind in ("output", "output_error"):
+                chunks.append(payload)
+                if kind == "output_error":
+                    errors.append(payload)
+            else:
+                finished = kind
+
+        if chunks:
+            self.on_output("\n".join(chunks), errors)
+        if self.cancelling and not self.thread.is_alive():
+            # Запуск считается прерванным только после реального выхода потока
+            self.cancelling = False
+            self.is_running = False
+            self.on_finish("cancelled")
+        elif finished:
+            self.is_running = False
+            self.on_finish(finished)
+        if self.is_running:
+            self.widget.after(self.POLL_INTERVAL, self._poll)
+        else:
+            self.polling = False
+
+    def cancel(self):
+        """Прерывание текущего запуска; исключение сработает, когда поток вернется в байт-код Python.
+        Блокирующий вызов C (sleep, input, чтение сокета) сначала должен завершиться сам"""
+        if not self.is_running or self.cancelling:
+            return False
+
+        thread = self.thread
+        if thread and thread.is_alive():
+            affected = ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                ctypes.c_ulong(thread.ident), ctypes.py_object(RunCancelled))
+            if affected > 1:
+                # Исключение попало не в один поток - отзываем его, запуск продолжается как был
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread.ident), None)
+                return False
+        # Поток уже завершился (affected == 0) - _poll закроет запуск на ближайшем кадре
+        self.run_id += 1  # результаты прерванного запуска будут отброшены
+        self.cancelling = True
+        self.on_finish("cancelling")
+        return True
+
+
+class PoolCodeRunner:
+    """Выполнение кода вкладки в пуле процессов, интерфейс как у CodeRunner"""
+
+    POLL_INTERVAL = 16
+
+    def __init__(self, widget, pool, tab_key, on_output, on_finish):
+        self.widget = widget
+        self.pool = pool
+        self.tab_key = tab_key
+        self.on_output = on_output
+        self.on_finish = on_finish
+        self.job_id = None
+        self.is_running = False
+
+    def start(self, code):
+        if self.is_running:
+            return False
+
+        self.job_id = self.pool.submit(self.tab_key, code)
+        self.is_running = True
+        self.widget.after(self.POLL_INTERVAL, self._poll)
+        return True
+
+    def _poll(self):
+        if not self.is_running:
+            return
+
+        self.pool.collect()
+        chunks = []
+        errors = []
+        finished = None
+        for kind, payload in self.pool.take(self.job_id):
+            if kind in ("output", "output_error"):
+                chunks.append(payload)
+                if kind == "output_error":
+                    errors.append(payload)
+            else:
+                finished = kind
+
+        if chunks:
+            self.on_output("\n".join(chunks), errors)
+        if finished:
+            self.is_running = False
+            self.on_finish(finished)
+        else:
+            self.widget.after(self.POLL_INTERVAL, self._poll)
+
+    def cancel(self):
+        if not self.is_running:
+            return False
+
+        self.is_running = False
+        self.pool.cancel(self.job_id)
+        self.on_finish("cancelled")
+        return True
 
 
 class FileTab:
@@ -197,6 +1119,11 @@ class FileTab:
         self.content = content
         self.path = path
         self.saved = True
+        self.loading = False  # буфер еще заполняется - сохранять и запускать нельзя
+        self.read_only = False  # содержимое не совпадает с файлом байт в байт - сохранение запрещено
+        self.newline = None  # перевод строки файла для сохранения (None - системный)
+        self.version = 0  # счетчик правок буфера
+        self.journal_id = None
 
 
 class CodeApp(tk.Tk):
@@ -209,7 +1136,37 @@ class CodeApp(tk.Tk):
         # Инициализация атрибутов
         self.cmd_running = False  # Флаг выполнения команды
         self.chat_messages = []
-        self.ai_request_manager = AIRequestManager(self._handle_ai_response)
+        self.chat_pending = []  # сообщения, ждущие вывода в ближайшем кадре
+        self.chat_rendered = deque()  # (метка начала, id блоков кода) сообщений в виджете
+        self.chat_code_blocks = {}  # id блока -> код для кнопки копирования
+        self.chat_code_seq = 0
+        self.chat_message_seq = 0
+        self.chat_trimmed = 0  # сообщений, убранных из виджета
+        self.startup_warnings = []  # выводятся в чат, когда он создан
+        try:
+            cache = ResponseCache(AI_CACHE_SIZE, AI_CACHE_DIR, AI_CACHE_DISK_LIMIT, AI_CACHE_TTL)
+        except OSError as e:
+            cache = ResponseCache(AI_CACHE_SIZE)  # только память
+            self.startup_warnings.append(f"Кэш ответов ИИ на диске отключен: {e}")
+        self.ai_request_manager = AIRequestManager(self._handle_ai_response, cache=cache)
+        self.stream_tokens = []  # токены, ждущие вывода в чат
+        self.stream_lock = threading.Lock()
+        self.stream_flush_pending = False
+        self.stream_active = False  # в чате есть незавершенный потоковый ответ
+        self.ai_pending = set()  # id запросов, ответы которых ждет чат
+        self.ai_stream_id = None  # id запроса, ответ которого выводится потоком
+        self.ai_status_job = None
+        self.recent_errors = deque(maxlen=AI_CONTEXT_ERRORS)  # ошибки выполнения для контекста ИИ
+        self.code_runners = {}  # id(FileTab) -> исполнитель кода вкладки
+        self.script_pool = None
+        self.save_queue = SaveQueue()
+        try:
+            self.journal = EditJournal(JOURNAL_DIR)
+        except OSError as e:
+            # Без доступа к домашнему каталогу IDE работает, но правки не журналируются
+            self.journal = None
+            self.startup_warnings.append(f"Журнал восстановления отключен: {e}")
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Темная цветовая схема
         self.colors = {
@@ -240,6 +1197,7 @@ class CodeApp(tk.Tk):
         self.create_menu()
         self.create_widgets()
         self.init_enhanced_ai_agent()
+        self.restore_journals()
 
     def create_menu(self):
         """Создание классического верхнего меню"""
@@ -255,9 +1213,10 @@ class CodeApp(tk.Tk):
         menubar.add_cascade(label="Файл", menu=file_menu)
         file_menu.add_command(label="Новый файл", command=self.new_file, accelerator="Ctrl+N")
         file_menu.add_command(label="Открыть", command=self.load_file, accelerator="Ctrl+O")
+        file_menu.add_command(label="Просмотр большого файла", command=self.open_viewer)
         file_menu.add_command(label="Сохранить", command=self.save_file, accelerator="Ctrl+S")
         file_menu.add_separator()
-        file_menu.add_command(label="Выход", command=self.quit)
+        file_menu.add_command(label="Выход", command=self.on_close)
 
         # Меню "Правка"
         edit_menu = tk.Menu(menubar, tearoff=0, bg=self.colors["bg"], fg="#d4d4d4",
@@ -346,6 +1305,9 @@ class CodeApp(tk.Tk):
         # Инициализация
         self.file_tabs = []
         self.file_editors = []
+        self.highlighters = {}  # Text -> SyntaxHighlighter
+        self.text_proxies = {}  # Text -> TextProxy
+        self.scheduler = FrameScheduler(self)
         self.new_file()
 
         # Горячие клавиши
@@ -429,6 +1391,21 @@ class CodeApp(tk.Tk):
                               command=self.clear_debugger)
         clear_btn.pack(side=tk.RIGHT, padx=12, pady=8)
 
+        # Кнопка прерывания выполнения кода
+        self.run_kill_button = tk.Button(debug_header, text="Прервать",
+                                         bg=self.colors["btn_danger"], fg="#ffffff",
+                                         font=("Segoe UI", 8),
+                                         relief="flat", borderwidth=0,
+                                         command=self.cancel_run,
+                                         state="disabled")
+        self.run_kill_button.pack(side=tk.RIGHT, padx=(12, 0), pady=8)
+
+        # Статус выполнения
+        self.run_status_label = tk.Label(debug_header, text="Готов",
+                                         bg=self.colors["debugger_bg"], fg="#4ec9b0",
+                                         font=("Segoe UI", 9, "bold"))
+        self.run_status_label.pack(side=tk.RIGHT, padx=12, pady=10)
+
         # Область вывода отладчика
         self.debugger = scrolledtext.ScrolledText(
             debugger_frame,
@@ -679,6 +1656,16 @@ class CodeApp(tk.Tk):
         # Приветственные сообщения
         self.add_system_message("ИИ Помощник инициализирован")
         self.add_system_message("Используйте Ctrl+Enter для отправки сообщения")
+        for warning in self.startup_warnings + self.ai_request_manager.warnings:
+            self.add_system_message(warning)
+
+        # Модель загружается в фоне сразу, а не при первом вопросе
+        self.last_activity = time.monotonic()
+        self.model_error_shown = False  # о недоступности модели сообщаем один раз до восстановления
+        self.bind_all("<Key>", self.note_ai_activity, add="+")
+        self.bind_all("<Button>", self.note_ai_activity, add="+")
+        self.warm_up_ai()
+        self.after(AI_ACTIVITY_CHECK, self.check_ai_keep_alive)
 
     def setup_chat_tags(self):
         """Настройка тегов для форматирования чата"""
@@ -709,80 +1696,123 @@ class CodeApp(tk.Tk):
                                         foreground="#6a9955",
                                         font=("Segoe UI", 8))
 
+        # Кнопки копирования кода - области текста с общим обработчиком
+        self.chat_display.tag_configure("copy_button",
+                                        background=self.colors["btn_normal"],
+                                        foreground="#d4d4d4",
+                                        font=("Segoe UI", 8))
+        self.chat_display.tag_bind("copy_button", "<Button-1>", self.on_copy_click)
+        self.chat_display.tag_bind("copy_button", "<Enter>",
+                                   lambda e: self.chat_display.config(cursor="hand2"))
+        self.chat_display.tag_bind("copy_button", "<Leave>",
+                                   lambda e: self.chat_display.config(cursor=""))
+
     def add_message(self, sender, content, message_type="text"):
-        """Добавление сообщения в чат"""
+        """Добавление сообщения в чат; вывод откладывается до ближайшего кадра и идет пачкой"""
         message = ChatMessage(sender, content, message_type=message_type)
         self.chat_messages.append(message)
+        self.chat_pending.append(message)
+        self.scheduler.request("chat", self.render_chat)
+
+    def render_chat(self):
+        """Вывод накопленных сообщений одним проходом и обрезка старых"""
+        if not self.chat_pending:
+            return
+        messages, self.chat_pending = self.chat_pending, []
+        at_bottom = self.chat_display.yview()[1] >= 0.999
 
         self.chat_display.config(state="normal")
+        for message in messages:
+            code_ids = []
+            segments = self.message_segments(message, code_ids)
+            # Метка начала сообщения: по ним старые сообщения убираются из виджета
+            self.chat_message_seq += 1
+            mark = f"msg_{self.chat_message_seq}"
+            self.chat_display.mark_set(mark, "end-1c")
+            self.chat_display.mark_gravity(mark, tk.LEFT)
+            self.chat_display.insert(tk.END, *[item for segment in segments for item in segment])
+            self.chat_rendered.append((mark, code_ids))
+        self.trim_chat()
+        self.chat_display.config(state="disabled")
 
-        # Временная метка
+        # Прокрутка только если пользователь не читает историю выше
+        if at_bottom:
+            self.chat_display.see(tk.END)
+
+    def message_segments(self, message, code_ids):
+        """Сообщение в виде [(текст, теги)] для одного вызова insert"""
         timestamp = message.timestamp.strftime("%H:%M:%S")
-        self.chat_display.insert(tk.END, f"[{timestamp}] ", "timestamp")
+        segments = [(f"[{timestamp}] ", "timestamp")]
 
         # Отправитель
-        if sender == "user":
-            self.chat_display.insert(tk.END, "Вы: ", "user")
-        elif sender == "ai":
-            self.chat_display.insert(tk.END, "ИИ: ", "ai")
-        elif sender == "system":
-            self.chat_display.insert(tk.END, "Система: ", "system")
-        elif sender == "error":
-            self.chat_display.insert(tk.END, "Ошибка: ", "error")
+        labels = {"user": "Вы: ", "ai": "ИИ: ", "system": "Система: ", "error": "Ошибка: "}
+        if message.sender in labels:
+            segments.append((labels[message.sender], message.sender))
 
         # Обработка содержимого
-        if message_type == "code":
-            self.process_code_message(content)
+        if message.message_type == "code":
+            segments += self.code_segments(message.content, code_ids)
         else:
-            self.process_text_message(content)
+            segments += self.text_segments(message.content, code_ids)
 
-        self.chat_display.insert(tk.END, "\n\n")
-        self.chat_display.see(tk.END)
-        self.chat_display.config(state="disabled")
+        segments.append(("\n\n", ""))
+        return segments
 
-    def process_text_message(self, content):
-        """Обработка текстового сообщения с поддержкой кода"""
+    def text_segments(self, content, code_ids):
+        """Текстовое сообщение с поддержкой кода"""
         # Поиск блоков кода
         code_pattern = r'``````'
         parts = re.split(code_pattern, content, flags=re.DOTALL)
 
+        segments = []
         for i, part in enumerate(parts):
             if i % 2 == 0:  # Обычный текст
-                self.chat_display.insert(tk.END, part)
+                segments.append((part, ""))
             else:  # Код
-                self.insert_code_block(part)
-
-    def process_code_message(self, content):
-        """Обработка сообщения с кодом"""
-        self.insert_code_block(content)
-
-    def insert_code_block(self, code):
-        """Вставка блока кода с кнопкой копирования"""
-        self.chat_display.insert(tk.END, "\n")
-
-        # Заголовок блока кода
-        self.chat_display.insert(tk.END, "Код Python:", "system")
-        self.chat_display.insert(tk.END, "\n")
-
-        # Код
-        self.chat_display.insert(tk.END, code, "code")
-        self.chat_display.insert(tk.END, "\n")
-
-        # Кнопка копирования
-        copy_btn = tk.Button(
-            self.chat_display,
-            text="Копировать код",
-            font=("Segoe UI", 8),
-            bg=self.colors["btn_normal"],
-            fg="#d4d4d4",
-            relief="flat",
-            borderwidth=0,
-            padx=10, pady=6,
-            command=lambda: self.copy_code_to_clipboard(code),
-            cursor="hand2"
-        )
+                segments += self.code_segments(part, code_ids)
+        return segments
+
+    def code_segments(self, code, code_ids):
+        """Блок кода с кнопкой копирования - областью текста с тегом вместо виджета"""
+        self.chat_code_seq += 1
+        self.chat_code_blocks[self.chat_code_seq] = code
+        code_ids.append(self.chat_code_seq)
+        return [
+            ("\n", ""),
+            ("Код Python:", "system"),
+            ("\n", ""),
+            (code, "code"),
+            ("\n", ""),
+            (" Копировать код ", ("copy_button", f"codeblock:{self.chat_code_seq}")),
+        ]
 
-        self.chat_display.window_create(tk.INSERT, window=copy_btn)
+    def trim_chat(self):
+        """Удаление из виджета сообщений сверх CHAT_MAX_RENDERED; в chat_messages они остаются"""
+        excess = len(self.chat_rendered) - CHAT_MAX_RENDERED
+        if excess <= 0:
+            return
+        removed = [self.chat_rendered.popleft() for _ in range(excess)]
+        first_mark = self.chat_rendered[0][0]
+        self.chat_display.delete("1.0", first_mark)
+        for mark, code_ids in removed:
+            self.chat_display.mark_unset(mark)
+            for code_id in code_ids:
+                self.chat_code_blocks.pop(code_id, None)
+
+        self.chat_trimmed += excess
+        notice = f"Ранние сообщения скрыты: {self.chat_trimmed}\n\n"
+        self.chat_display.insert("1.0", notice, "system")
+        self.chat_display.mark_set(first_mark, f"1.0 + {len(notice)} chars")
+
+    def on_copy_click(self, event):
+        """Нажатие на «Копировать код»: блок определяется по тегу под курсором"""
+        for tag in self.chat_display.tag_names("current"):
+            if tag.startswith("codeblock:"):
+                code = self.chat_code_blocks.get(int(tag.split(":", 1)[1]))
+                if code is not None:
+                    self.copy_code_to_clipboard(code)
+                break
+        return "break"
 
     def add_system_message(self, content):
         """Добавление системного сообщения"""
@@ -795,23 +1825,27 @@ class CodeApp(tk.Tk):
         self.add_system_message("Код скопирован в буфер обмена")
 
     def clear_chat(self):
-        """Очистка чата"""
+        """Очистка чата; следующий вопрос начинает новый диалог"""
         self.chat_messages.clear()
+        self.chat_pending.clear()
+        self.ai_request_manager.conversation.reset()
         self.chat_display.config(state="normal")
         self.chat_display.delete("1.0", tk.END)
         self.chat_display.config(state="disabled")
+        for mark, _ in self.chat_rendered:
+            self.chat_display.mark_unset(mark)
+        self.chat_rendered.clear()
+        self.chat_code_blocks.clear()
+        self.chat_trimmed = 0
+        self.stream_active = False
         self.add_system_message("Чат очищен")
 
-    def start_ai_query(self, context_code=None):
+    def start_ai_query(self, context_code=None, priority=PRIORITY_INTERACTIVE):
         """Упрощенный запрос к ИИ"""
         user_input = self.ai_input.get("1.0", "end-1c").strip()
         if not user_input:
             return
 
-        if self.ai_request_manager.is_processing:
-            self.add_system_message("Дождитесь завершения предыдущего запроса")
-            return
-
         # Очистка поля ввода
         self.ai_input.delete("1.0", tk.END)
 
@@ -821,23 +1855,33 @@ class CodeApp(tk.Tk):
         # Получение контекста кода
         context = context_code if context_code else ""
 
-        # Всегда пытаемся получить код из редактора
+        # Из редактора берется только нужная часть: выделение, блок у курсора, последние ошибки
         try:
             tab, editor, _ = self.get_current_editor()
-            current_code = editor.get("1.0", "end-1c").strip()
-            if current_code:
-                context = current_code
+            context = self.collect_ai_context(editor) or context
         except Exception:
             pass
 
-        # Обновление интерфейса
+        # Запуск запроса; пока модель занята, он ждет в очереди
+        request_id = self.ai_request_manager.add_request(user_input, context, priority,
+                                                         remember=priority == PRIORITY_INTERACTIVE)
+        if request_id is None:
+            self.add_message("error", "Очередь запросов заполнена, попробуйте позже")
+            return
+        self.ai_pending.add(request_id)
         self.update_ui_for_processing(True)
 
-        # Запуск запроса
-        success = self.ai_request_manager.add_request(user_input, context)
-        if not success:
-            self.add_message("error", "Не удалось запустить запрос")
-            self.update_ui_for_processing(False)
+    def collect_ai_context(self, editor):
+        """Контекст запроса к ИИ в пределах AI_CONTEXT_TOKENS"""
+        code = editor.get("1.0", "end-1c")
+        if not code.strip():
+            return ""
+        cursor_line = int(editor.index("insert").split(".")[0])
+        try:
+            selection = editor.get("sel.first", "sel.last")
+        except tk.TclError:
+            selection = ""
+        return build_context(code, cursor_line, selection, list(self.recent_errors), AI_CONTEXT_TOKENS)
 
     def analyze_current_code(self):
         """Анализ текущего кода"""
@@ -863,8 +1907,8 @@ class CodeApp(tk.Tk):
             self.ai_input.delete("1.0", tk.END)
             self.ai_input.insert("1.0", analysis_prompt)
 
-            # Запуск анализа
-            self.start_ai_query(context_code=current_code)
+            # Запуск анализа: фоновый приоритет, вопросы из чата идут раньше
+            self.start_ai_query(context_code=current_code, priority=PRIORITY_BACKGROUND)
 
         except Exception as e:
             self.add_message("error", f"Ошибка при получении кода: {e}")
@@ -874,27 +1918,125 @@ class CodeApp(tk.Tk):
         self.analyze_current_code()
 
     def cancel_ai_request(self):
-        """Отмена текущего запроса"""
+        """Отмена выполняемых и ожидающих запросов"""
         self.ai_request_manager.cancel_request()
+        self.ai_pending.clear()
+        self.ai_stream_id = None
+        with self.stream_lock:
+            self.stream_tokens = []
+        self._end_ai_stream()
         self.update_ui_for_processing(False)
         self.add_system_message("Запрос отменен")
 
     def update_ui_for_processing(self, is_processing):
         """Обновление интерфейса во время обработки"""
         if is_processing:
-            self.send_button.config(state="disabled", text="Обработка...")
             self.cancel_button.config(state="normal")
-            self.status_label.config(text="Обработка...", fg="#ffd700")
+            if self.ai_status_job is None:  # цикл обновления уже идет - второй не нужен
+                self.update_ai_status()
         else:
-            self.send_button.config(state="normal", text="Отправить")
             self.cancel_button.config(state="disabled")
+            if self.ai_status_job is not None:
+                self.after_cancel(self.ai_status_job)
+                self.ai_status_job = None
+            self.show_ai_idle_status()
+
+    def show_ai_idle_status(self):
+        """Состояние модели в status_label, когда запросов нет"""
+        state = self.ai_request_manager.model_state
+        if state == "loading":
+            self.status_label.config(text="Загрузка модели...", fg="#ffd700")
+        elif state == "unloaded":
+            self.status_label.config(text="Модель выгружена", fg="#858585")
+        elif state == "error":
+            self.status_label.config(text="Модель недоступна", fg=self.colors["error_msg"])
+        else:
             self.status_label.config(text="Готов", fg="#4ec9b0")
 
-    def _handle_ai_response(self, status, response):
+    def warm_up_ai(self, unload=False):
+        """Фоновая загрузка модели, чтобы первый ответ не ждал чтения модели с диска"""
+        if self.ai_request_manager.warm_up(lambda state, error: self.after(0, self._on_model_state, state, error),
+                                           unload=unload):
+            if not self.ai_pending:
+                self.show_ai_idle_status()
+
+    def _on_model_state(self, state, error):
+        if state == "error":
+            if not self.model_error_shown:
+                self.model_error_shown = True
+                self.add_system_message(f"Модель недоступна: {error}")
+        else:
+            self.model_error_shown = False
+        if not self.ai_pending:
+            self.show_ai_idle_status()
+
+    def note_ai_activity(self, event=None):
+        """Действие пользователя: выгруженная модель загружается заново сразу"""
+        self.last_activity = time.monotonic()
+        if self.ai_request_manager.model_state == "unloaded":
+            self.warm_up_ai()
+
+    def check_ai_keep_alive(self):
+        """Пока пользователь работает, модель держится в памяти; после долгого простоя выгружается"""
+        manager = self.ai_request_manager
+        now = time.monotonic()
+        idle = now - self.last_activity
+        if manager.model_state != "loading" and not manager.is_processing:
+            try:
+                keep_alive = parse_duration(manager.config["keep_alive"])
+            except ValueError:
+                keep_alive = -1
+            if idle >= AI_IDLE_UNLOAD:
+                if manager.model_state == "ready":
+                    self.warm_up_ai(unload=True)
+            elif idle < AI_ACTIVITY_CHECK / 1000:
+                # Продление до истечения keep_alive на сервере: следующий запрос не ждет загрузки
+                expiring = keep_alive > 0 and now - manager.last_used > keep_alive * 0.8
+                if manager.model_state == "error":
+                    pass  # недоступный сервер не опрашивается: повтор - по запросу пользователя или смене настроек
+                elif manager.model_state != "ready" or expiring:
+                    self.warm_up_ai()
+        self.after(AI_ACTIVITY_CHECK, self.check_ai_keep_alive)
+
+    def update_ai_status(self):
+        """Состояние очереди запросов в status_label, обновляется раз в полсекунды"""
+        self.ai_status_job = None
+        if not self.ai_pending:
+            return
+        running, queued, oldest = self.ai_request_manager.queue_stats()
+        text = "Генерация..." if self.stream_active else "Обработка..."
+        if queued:
+            text += f" в очереди: {queued}, ждет {oldest:.0f} с"
+        elif self.ai_request_manager.last_wait >= 1:
+            text += f" (ждал в очереди {self.ai_request_manager.last_wait:.0f} с)"
+        self.status_label.config(text=text, fg="#ffd700")
+        self.ai_status_job = self.after(500, self.update_ai_status)
+
+    def _handle_ai_response(self, status, response, request_id):
         """Обработка ответа от ИИ"""
+        if status == "token":
+            # Вызывается из потока запроса: токены копятся и выводятся пачкой раз в интервал
+            with self.stream_lock:
+                self.stream_tokens.append((request_id, response))
+                if self.stream_flush_pending:
+                    return
+                self.stream_flush_pending = True
+            self.after(STREAM_FLUSH_INTERVAL, self._flush_ai_stream)
+            return
 
         def update_ui():
-            if status == "success":
+            if request_id not in self.ai_pending:
+                return  # поздний ответ отмененного запроса
+            self.ai_pending.discard(request_id)
+            if request_id == self.ai_stream_id:
+                self._flush_ai_stream()
+                self._end_ai_stream()
+                self.ai_stream_id = None
+            if status == "cached":
+                self.add_message("ai", process_content(response))
+                self.add_system_message("Ответ взят из кэша, модель не вызывалась")
+            elif status == "success":
+                self.model_error_shown = False  # модель снова отвечает
                 if response.strip():
                     cleaned_response = process_content(response)
                     self.add_message("ai", cleaned_response)
@@ -903,10 +2045,50 @@ class CodeApp(tk.Tk):
             else:
                 self.add_message("error", f"Ошибка запроса: {response}")
 
-            self.update_ui_for_processing(False)
+            self.update_ui_for_processing(bool(self.ai_pending))
 
         self.after(0, update_ui)
 
+    def _flush_ai_stream(self):
+        """Вывод накопленных токенов в конец потокового ответа"""
+        with self.stream_lock:
+            tokens = self.stream_tokens
+            self.stream_tokens = []
+            self.stream_flush_pending = False
+        # Потоком выводится один ответ; остальные параллельные появятся целиком по готовности
+        if self.ai_stream_id is None:
+            self.ai_stream_id = next((request_id for request_id, _ in tokens
+                                      if request_id in self.ai_pending), None)
+        tokens = [token for request_id, token in tokens if request_id == self.ai_stream_id]
+        if not tokens:
+            return
+        self.render_chat()  # черновик ответа идет после уже добавленных сообщений
+
+        self.chat_display.config(state="normal")
+        if not self.stream_active:
+            self.stream_active = True
+            self.chat_display.mark_set("ai_stream_start", "end-1c")
+            self.chat_display.mark_gravity("ai_stream_start", tk.LEFT)
+            timestamp = datetime.now().strftime("%H:%M:%S")
+            self.chat_display.insert(tk.END, f"[{timestamp}] ", "timestamp")
+            self.chat_display.insert(tk.END, "ИИ: ", "ai")
+            self.chat_display.insert(tk.END, "\n\n")
+            # Метка перед завершающими переводами строк; сообщения, добавленные позже, идут после
+            self.chat_display.mark_set("ai_stream_end", "end-3c")
+            self.chat_display.mark_gravity("ai_stream_end", tk.RIGHT)
+        self.chat_display.insert("ai_stream_end", "".join(tokens))
+        self.chat_display.see(tk.END)
+        self.chat_display.config(state="disabled")
+
+    def _end_ai_stream(self):
+        """Замена черновика потокового ответа: итоговый текст выводится через add_message"""
+        if not self.stream_active:
+            return
+        self.stream_active = False
+        self.chat_display.config(state="normal")
+        self.chat_display.delete("ai_stream_start", "ai_stream_end + 2c")
+        self.chat_display.config(state="disabled")
+
     # === Методы для работы с файлами и редактором ===
 
     def bind_hotkeys(self):
@@ -943,7 +2125,7 @@ class CodeApp(tk.Tk):
         """Окно настроек"""
         settings_window = tk.Toplevel(self)
         settings_window.title("Настройки")
-        settings_window.geometry("400x300")
+        settings_window.geometry("460x480")
         settings_window.configure(bg=self.colors["bg"])
         settings_window.resizable(False, False)
 
@@ -964,11 +2146,63 @@ class CodeApp(tk.Tk):
                                  font=("Segoe UI", 10, "bold"))
         ai_frame.pack(padx=20, pady=10, fill=tk.X)
 
-        model_label = tk.Label(ai_frame,
-                               text=f"Текущая модель: {MODEL}",
-                               bg=self.colors["bg"],
-                               fg="#d4d4d4")
-        model_label.pack(pady=5)
+        config = self.ai_request_manager.config
+        fields = [
+            ("backend", "Сервер модели"),
+            ("endpoint", "Адрес сервера"),
+            ("model", "Модель"),
+            ("num_ctx", "Окно контекста (токенов)"),
+            ("num_thread", "Потоков (пусто - авто)"),
+            ("keep_alive", "Держать модель в памяти"),
+        ]
+        variables = {}
+        for row, (key, label) in enumerate(fields):
+            tk.Label(ai_frame, text=label, bg=self.colors["bg"], fg="#d4d4d4",
+                     anchor="w").grid(row=row, column=0, sticky="w", padx=8, pady=4)
+            value = config.get(key)
+            variables[key] = tk.StringVar(value="" if value is None else str(value))
+            if key == "backend":
+                widget = ttk.Combobox(ai_frame, textvariable=variables[key],
+                                      values=list(BACKENDS), state="readonly", width=24)
+            else:
+                widget = tk.Entry(ai_frame, textvariable=variables[key], width=27,
+                                  bg=self.colors["input_bg"], fg="#d4d4d4",
+                                  insertbackground="#d4d4d4", relief="flat")
+            widget.grid(row=row, column=1, sticky="ew", padx=8, pady=4)
+
+        routing_label = tk.Label(ai_frame,
+                                 text="Дополнительные модели для маршрутизации\n"
+                                      "задаются в файле ~/.tcode/ai.json (\"models\")",
+                                 bg=self.colors["bg"], fg="#858585", font=("Segoe UI", 8),
+                                 justify="left")
+        routing_label.grid(row=len(fields), column=0, columnspan=2, sticky="w", padx=8, pady=(8, 4))
+
+        def apply_settings():
+            new_config = dict(config)
+            try:
+                for key, _ in fields:
+                    value = variables[key].get().strip()
+                    if key == "num_ctx":
+                        value = int(value)
+                    elif key == "num_thread":
+                        value = int(value) if value else None
+                    new_config[key] = value
+                self.ai_request_manager.configure(new_config)
+                save_config(new_config)
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось применить настройки:\n{e}", parent=settings_window)
+                return
+            self.add_system_message(f"Модель: {new_config['model']} ({new_config['backend']}, "
+                                    f"{new_config['endpoint']})")
+            settings_window.destroy()
+            self.model_error_shown = False
+            self.warm_up_ai()
+
+        save_button = tk.Button(settings_window, text="Сохранить",
+                                bg=self.colors["btn_normal"], fg="#d4d4d4",
+                                relief="flat", borderwidth=0, padx=20, pady=8,
+                                command=apply_settings, cursor="hand2")
+        save_button.pack(pady=10)
 
     def insert_spaces(self, event=None):
         widget = event.widget
@@ -987,66 +2221,19 @@ class CodeApp(tk.Tk):
         widget.insert("insert", f"\n{indent}")
         return "break"
 
-    def highlight_syntax(self, event=None):
+    def highlight_syntax(self, full=False):
         try:
             _, input_text, _ = self.get_current_editor()
         except Exception:
             return
 
-        code = input_text.get("1.0", "end-1c")
-
-        for tag in input_text.tag_names():
-            input_text.tag_remove(tag, "1.0", "end")
-
-        # Ключевые слова Python
-        arguments = r"\b(self|get)\b"
-        symbols = r"\b(neural|layer|PiCore|delta|var)\b"
-        important = r"\b(import|from|return|or|not|None|in|is)\b"
-        funct = r"\b(print|input|def|if|else|elif|class|for|while)\b"
-        keywords = r"\b(False|True|and|as|assert|async|await|break|continue|del|except|finally|range|global|lambda|nonlocal|pass|raise|return|try|with|yield)\b"
-
-
-        for match in re.finditer(keywords, code):
-            start = f"1.0+{match.start()}c"
-            end = f"1.0+{match.end()}c"
-            input_text.tag_add("keyword", start, end)
-            input_text.tag_config("keyword", foreground="#6b5aef")
-
-        for match in re.finditer(symbols, code):
-            start = f"1.0+{match.start()}c"
-            end = f"1.0+{match.end()}c"
-            input_text.tag_add("symbols", start, end)
-            input_text.tag_config("symbols", foreground="#e45b53")
-
-        for match in re.finditer(important, code):
-            start = f"1.0+{match.start()}c"
-            end = f"1.0+{match.end()}c"
-            input_text.tag_add("important", start, end)
-            input_text.tag_config("important", foreground="#14a5e3")
-
-
-        for match in re.finditer(funct, code):
-            start = f"1.0+{match.start()}c"
-            end = f"1.0+{match.end()}c"
-            input_text.tag_add("funct", start, end)
-            input_text.tag_config("funct", foreground="#d69a56")
-
-        # Строки
-        for match in re.finditer(r'".*?"|\'.*?\'', code):
-            start = f"1.0+{match.start()}c"
-            end = f"1.0+{match.end()}c"
-            input_text.tag_add("string", start, end)
-            input_text.tag_config("string", foreground="#9ace78")
-
-        # Комментарии
-        for match in re.finditer(r"#.*", code):
-            start = f"1.0+{match.start()}c"
-            end = f"1.0+{match.end()}c"
-            input_text.tag_add("comment", start, end)
-            input_text.tag_config("comment", foreground="#696969")
+        highlighter = self.highlighters.get(input_text)
+        if highlighter is None:
+            return
+        highlighter.highlight(full=full)
 
-    def new_file(self):
-        tab = FileTab()
+    def create_editor(self, tab, content="", highlight=True, undo=True, track_edits=True):
+        """Создание вкладки редактора с номерами строк и подсветкой"""
         frame = tk.Frame(self.file_notebook, bg=self.colors["editor_bg"])
 
         # Создание редактора с правильными номерами строк
@@ -1054,14 +2241,17 @@ class CodeApp(tk.Tk):
         editor_container.pack(fill=tk.BOTH, expand=True, padx=8, pady=8)
 
         # Текстовый виджет
-        input_text = tk.Text(editor_container, wrap='none', undo=True, font=("Consolas", 11),
+        input_text = tk.Text(editor_container, wrap='none', undo=undo, font=("Consolas", 11),
                              background=self.colors["editor_bg"], foreground=self.colors["editor_fg"],
                              insertbackground="#d4d4d4", selectbackground="#264f78",
                              relief="flat", padx=12, pady=12,
                              borderwidth=0)
+        if content:
+            input_text.insert("1.0", content)
 
         # Номера строк
-        line_numbers = LineNumbers(editor_container, input_text)
+        line_numbers = LineNumbers(editor_container, input_text, scheduler=self.scheduler)
+        self.text_proxies[input_text] = TextProxy(input_text)
 
         # Размещение виджетов
         line_numbers.pack(side=tk.LEFT, fill=tk.Y)
@@ -1070,14 +2260,16 @@ class CodeApp(tk.Tk):
         # Скроллбар
         scrollbar = tk.Scrollbar(editor_container, orient=tk.VERTICAL, command=input_text.yview)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        input_text.config(yscrollcommand=scrollbar.set)
 
-        # Привязка событий
+        line_numbers.scroll_listeners.append(scrollbar.set)
+        if highlight:
+            self.attach_highlighter(line_numbers, input_text)
+        if track_edits:
+            self.attach_journal(tab, input_text)
+
+        # Привязка событий; правки подсвечиваются через перехватчик SyntaxHighlighter
         input_text.bind("<Tab>", self.insert_spaces)
         input_text.bind("<Return>", self.auto_indent)
-        input_text.bind("<KeyRelease>", self.highlight_syntax)
-        input_text.bind("<Button-1>", lambda e: line_numbers.redraw())
-        input_text.bind("<MouseWheel>", lambda e: line_numbers.redraw())
 
         # Добавление вкладки
         tab_text = f"{tab.name}"
@@ -1088,6 +2280,91 @@ class CodeApp(tk.Tk):
 
         # Инициальная отрисовка номеров строк
         self.after(100, line_numbers.redraw)
+        return line_numbers, input_text
+
+    def attach_highlighter(self, line_numbers, input_text):
+        """Подключение подсветки; при прокрутке подсвечиваются строки, попавшие в видимую область"""
+        highlighter = SyntaxHighlighter(input_text, self.text_proxies[input_text], scheduler=self.scheduler)
+        self.highlighters[input_text] = highlighter
+        line_numbers.scroll_listeners.append(lambda first, last: highlighter.request_highlight(idle=True))
+        return highlighter
+
+    def attach_journal(self, tab, input_text):
+        """Учет правок вкладки: сброс tab.saved и запись дельт в журнал восстановления"""
+        def on_change(kind, start, arg):
+            tab.saved = False
+            tab.version += 1
+            if self.journal is None:
+                return
+            if tab.journal_id is None:
+                tab.journal_id = self.journal.open(self._journal_header(tab))
+            if kind == "insert":
+                record = {"t": "i", "at": start, "text": arg}
+            else:
+                record = {"t": "d", "from": start, "to": arg}
+            if self.journal.append(tab.journal_id, record):
+                self.journal.compact(tab.journal_id, self._journal_header(tab),
+                                     input_text.get("1.0", "end-1c"))
+
+        self.text_proxies[input_text].listeners.append(on_change)
+
+    def _journal_header(self, tab):
+        header = {"t": "h", "name": tab.name, "path": tab.path, "mtime": None, "size": None}
+        if tab.path and os.path.exists(tab.path):
+            stat = os.stat(tab.path)
+            header["mtime"], header["size"] = stat.st_mtime, stat.st_size
+        return header
+
+    def restore_journals(self):
+        """Восстановление несохраненных буферов из журналов прошлого запуска"""
+        if self.journal is None:
+            return
+        for journal_file, records in self.journal.load_all():
+            header = records[0]
+            snapshots = [n for n, record in enumerate(records) if record.get("t") == "s"]
+            start = snapshots[-1] if snapshots else 0
+            name = header.get("name") or "Безымянный.tcd"
+
+            try:
+                if snapshots:
+                    content = records[start]["text"]
+                elif header.get("path"):
+                    # Без снимка дельты применимы только к неизмененному исходному файлу
+                    stat = os.stat(header["path"])
+                    if (stat.st_mtime, stat.st_size) != (header.get("mtime"), header.get("size")):
+                        raise ValueError("исходный файл изменился")
+                    with open(header["path"], "r", encoding="utf-8") as f:
+                        content = f.read()
+                else:
+                    content = ""
+            except Exception as e:
+                self.add_system_message(f"Не удалось восстановить {name}: {e}")
+                self.journal.remove_file(journal_file)
+                continue
+
+            tab = FileTab(name=name, content=content, path=header.get("path"))
+            line_numbers, input_text = self.create_editor(tab, content, highlight=False, track_edits=False)
+            for record in records[start + 1:]:
+                if record.get("t") == "i":
+                    input_text.insert(record["at"], record["text"])
+                elif record.get("t") == "d":
+                    input_text.delete(record["from"], record["to"])
+            input_text.edit_reset()
+
+            self.attach_highlighter(line_numbers, input_text).highlight()
+            self.attach_journal(tab, input_text)
+
+            # Восстановленный буфер сразу сжимается в снимок нового журнала
+            tab.saved = False
+            tab.journal_id = self.journal.open(self._journal_header(tab))
+            self.journal.compact(tab.journal_id, self._journal_header(tab), input_text.get("1.0", "end-1c"))
+            self.journal.remove_file(journal_file)
+            self.file_notebook.tab(self.file_notebook.select(), text=f"{name} [восстановлен]")
+            self.add_system_message(f"Восстановлен несохраненный буфер: {name}")
+        self.journal.release_claims()
+
+    def new_file(self):
+        self.create_editor(FileTab())
 
     def load_file(self):
         filetypes = [
@@ -1100,95 +2377,282 @@ class CodeApp(tk.Tk):
         filepath = filedialog.askopenfilename(filetypes=filetypes)
         if filepath:
             try:
+                if os.path.getsize(filepath) > VIEWER_FILE_SIZE:
+                    self.open_viewer(filepath)
+                    return
+                if os.path.getsize(filepath) > LARGE_FILE_SIZE:
+                    self.load_large_file(filepath)
+                    return
+
                 with open(filepath, "r", encoding="utf-8") as f:
                     content = f.read()
 
                 tab = FileTab(name=os.path.basename(filepath), content=content, path=filepath)
-                frame = tk.Frame(self.file_notebook, bg=self.colors["editor_bg"])
-
-                editor_container = tk.Frame(frame, bg=self.colors["editor_bg"])
-                editor_container.pack(fill=tk.BOTH, expand=True, padx=8, pady=8)
-
-                # Текстовый виджет
-                input_text = tk.Text(editor_container, wrap='none', undo=True, font=("Consolas", 11),
-                                     background=self.colors["editor_bg"], foreground=self.colors["editor_fg"],
-                                     insertbackground="#d4d4d4", selectbackground="#264f78",
-                                     relief="flat", padx=12, pady=12,
-                                     borderwidth=0)
-                input_text.insert("1.0", content)
-
-                # Номера строк
-                line_numbers = LineNumbers(editor_container, input_text)
-
-                # Размещение виджетов
-                line_numbers.pack(side=tk.LEFT, fill=tk.Y)
-                input_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-
-                # Скроллбар
-                scrollbar = tk.Scrollbar(editor_container, orient=tk.VERTICAL, command=input_text.yview)
-                scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-                input_text.config(yscrollcommand=scrollbar.set)
-
-                # Привязка событий
-                input_text.bind("<Tab>", self.insert_spaces)
-                input_text.bind("<Return>", self.auto_indent)
-                input_text.bind("<KeyRelease>", self.highlight_syntax)
-                input_text.bind("<Button-1>", lambda e: line_numbers.redraw())
-                input_text.bind("<MouseWheel>", lambda e: line_numbers.redraw())
-
-                tab_text = f"{tab.name}"
-                self.file_notebook.add(frame, text=tab_text)
-                self.file_tabs.append(tab)
-                self.file_editors.append((line_numbers, input_text))
-                self.file_notebook.select(len(self.file_tabs) - 1)
-
+                self.create_editor(tab, content)
                 self.highlight_syntax()
-                self.after(100, line_numbers.redraw)
                 self.add_system_message(f"Файл загружен: {os.path.basename(filepath)}")
 
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Не удалось загрузить файл:\n{e}")
 
+    def load_large_file(self, filepath):
+        """Загрузка большого файла частями в простое через mmap"""
+        size = os.path.getsize(filepath)
+        plain = size > PLAIN_VIEW_SIZE
+        name = os.path.basename(filepath)
+
+        tab = FileTab(name=name, content="", path=filepath)
+        tab.loading = True
+        tab.read_only = plain
+        # История правок включается после загрузки, чтобы не копить в ней весь файл
+        line_numbers, input_text = self.create_editor(tab, highlight=False, undo=False, track_edits=False)
+        frame = self.file_notebook.select()
+        input_text.config(state="disabled")  # до окончания загрузки правки запрещены
+
+        f = open(filepath, "rb")
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            f.close()
+            raise
+
+        mode = "только чтение, без подсветки" if plain else "загрузка частями"
+        self.add_system_message(f"Большой файл ({size // (1024 * 1024)} МБ), {mode}: {name}")
+
+        # Строгое декодирование: буфер, который можно сохранить, обязан совпадать с файлом
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        stats = {"lossy": False, "crlf": 0, "lf": 0}
+
+        def finish():
+            tab.loading = False
+            mapped.close()
+            f.close()
+
+        def chunk_end(pos):
+            """Конец части: перевод строки не дальше двух LOAD_CHUNK_SIZE, иначе граница символа UTF-8"""
+            end = min(pos + LOAD_CHUNK_SIZE, size)
+            if end >= size:
+                return size
+            newline = mapped.find(b"\n", end, min(end + LOAD_CHUNK_SIZE, size))
+            if newline != -1:
+                return newline + 1
+            # Очень длинная строка (минифицированный файл) режется, чтобы insert оставался коротким
+            while end > pos + 1 and mapped[end] & 0xC0 == 0x80:
+                end -= 1
+            if mapped[end - 1] == 0x0D and end > pos + 1:
+                end -= 1  # \r\n не разрывается между частями
+            return end
+
+        def decode(data, final):
+            nonlocal decoder
+            try:
+                return decoder.decode(data, final)
+            except UnicodeDecodeError:
+                # Файл не в UTF-8: показываем с заменой символов, но сохранять такой буфер нельзя
+                stats["lossy"] = True
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                return decoder.decode(data, final)
+
+        def load_chunk(pos=0):
+            try:
+                end = chunk_end(pos)
+                data = mapped[pos:end]
+                stats["crlf"] += data.count(b"\r\n")
+                stats["lf"] += data.count(b"\n")
+                chunk = decode(data, end >= size).replace("\r\n", "\n")
+
+                input_text.config(state="normal")
+                input_text.insert("end-1c", chunk)
+                input_text.config(state="disabled")
+                self.file_notebook.tab(frame, text=f"{name} [{end * 100 // size}%]")
+            except tk.TclError:
+                finish()  # вкладка закрыта во время загрузки
+                return
+
+            if end < size:
+                self.after(1, load_chunk, end)
+                return
+
+            finish()
+            if stats["crlf"]:
+                tab.newline = "\r\n"
+            if stats["lossy"] or stats["crlf"] not in (0, stats["lf"]):
+                # Недопустимые байты UTF-8 или смешанные переводы строк не восстановить при записи
+                tab.read_only = True
+                reason = "не UTF-8" if stats["lossy"] else "смешанные переводы строк"
+                self.add_system_message(f"Файл открыт только для чтения ({reason}): {name}")
+            if tab.read_only:
+                self.file_notebook.tab(frame, text=f"{name} [только чтение]")
+            else:
+                self.file_notebook.tab(frame, text=name)
+                input_text.config(state="normal", undo=True)
+                self.attach_highlighter(line_numbers, input_text).highlight()
+                self.attach_journal(tab, input_text)
+            input_text.mark_set("insert", "1.0")
+            input_text.see("1.0")
+            self.add_system_message(f"Файл загружен: {name}")
+
+        self.after_idle(load_chunk)
+
+    def open_viewer(self, filepath=None):
+        """Открытие файла в просмотрщике только для чтения"""
+        if filepath is None:
+            filepath = filedialog.askopenfilename(filetypes=[("Log files", "*.log"), ("All files", "*.*")])
+            if not filepath:
+                return
+
+        try:
+            viewer = LogViewer(self.file_notebook, filepath, self.colors, scheduler=self.scheduler)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось открыть файл:\n{e}")
+            return
+
+        tab = FileTab(name=os.path.basename(filepath), path=filepath)
+        self.file_notebook.add(viewer, text=f"{tab.name} [просмотр]")
+        self.file_tabs.append(tab)
+        self.file_editors.append((None, viewer))
+        self.file_notebook.select(len(self.file_tabs) - 1)
+        self.add_system_message(f"Файл открыт для просмотра: {tab.name}")
+
     def switch_file_tab(self, event=None):
         try:
             idx = self.file_notebook.index(self.file_notebook.select())
             line_numbers, input_text = self.file_editors[idx]
+            if isinstance(input_text, LogViewer):
+                input_text.request_render()
+                return
             self.highlight_syntax()
             line_numbers.redraw()
+            runner = self.code_runners.get(id(self.file_tabs[idx]))
+            if runner and getattr(runner, "cancelling", False):
+                self.update_run_status("cancelling")
+            else:
+                self.update_run_status("running" if runner and runner.is_running else "done")
         except Exception:
             pass
 
     def get_current_editor(self):
         idx = self.file_notebook.index(self.file_notebook.select())
+        if isinstance(self.file_editors[idx][1], LogViewer):
+            raise ValueError("Вкладка просмотра не поддерживает редактирование")
         return self.file_tabs[idx], self.file_editors[idx][1], self.file_editors[idx][0]
 
     def output(self, text):
         self._debugger_insert(str(text) + "\n")
 
+    def get_code_runner(self, tab):
+        """Исполнитель кода для вкладки; вкладки выполняются независимо друг от друга"""
+        runner = self.code_runners.get(id(tab))
+        if runner is None:
+            on_output = lambda text, errors: self._run_output(tab, text, errors)
+            on_finish = lambda status: self._on_run_finished(tab, status)
+            if RUN_BACKEND == "process":
+                if self.script_pool is None:
+                    self.script_pool = ScriptPool(workers=RUN_WORKERS,
+                                                  time_limit=RUN_TIME_LIMIT,
+                                                  memory_limit=RUN_MEMORY_LIMIT)
+                runner = PoolCodeRunner(self, self.script_pool, id(tab), on_output, on_finish)
+            else:
+                runner = CodeRunner(self, on_output, on_finish)
+            self.code_runners[id(tab)] = runner
+        return runner
+
     def run_code(self):
         global i
-        i += 1
-        self._debugger_insert("\n" + "=" * 30 + f" OUTPUT {i} " + "=" * 30 + "\n")
 
         try:
-            _, input_text, _ = self.get_current_editor()
+            tab, input_text, _ = self.get_current_editor()
             code = input_text.get("1.0", tk.END).strip()
+        except Exception as e:
+            self.output(f"Ошибка выполнения: {e}")
+            return
 
-            if not code:
-                self.output("Нет кода для выполнения")
-                return
+        if tab.loading:
+            self.output("Файл еще загружается, дождитесь окончания")
+            return
 
-            compiled = c.t_compile(code)
-            self.output(compiled)
+        runner = self.get_code_runner(tab)
+        if runner.is_running:
+            self.output("Дождитесь завершения текущего выполнения")
+            return
 
-        except Exception as e:
-            self.output(f"Ошибка выполнения: {e}")
+        i += 1
+        self._debugger_insert("\n" + "=" * 30 + f" OUTPUT {i} ({tab.name}) " + "=" * 30 + "\n")
 
-        self._debugger_insert("=" * 70 + "\n\n")
+        if not code:
+            self.output("Нет кода для выполнения")
+            self._debugger_insert("=" * 70 + "\n\n")
+            return
+
+        # Код выполняется в фоне, результаты приходят через after()
+        runner.start(code)
+        self.update_run_status("running")
+
+    def cancel_run(self):
+        """Прерывает выполнение кода текущей вкладки"""
+        try:
+            tab, _, _ = self.get_current_editor()
+        except Exception:
+            return
+        self.get_code_runner(tab).cancel()
+
+    def _run_output(self, tab, text, errors=()):
+        # При параллельном выполнении нескольких вкладок помечаем источник вывода
+        running = sum(1 for runner in self.code_runners.values() if runner.is_running)
+        if running > 1:
+            text = f"[{tab.name}] {text}"
+        # В контекст ИИ попадают только результаты, которые исполнитель пометил как ошибки
+        for error in errors:
+            self.recent_errors.append(f"[{tab.name}] {error}")
+        self.output(text)
+
+    def _on_run_finished(self, tab, status):
+        if status == "cancelling":
+            # Запуск еще не завершен: END выводится, когда поток действительно выйдет
+            self.output(f"Прерывание... ({tab.name})")
+            try:
+                current_tab, _, _ = self.get_current_editor()
+            except Exception:
+                return
+            if current_tab is tab:
+                self.update_run_status(status)
+            return
+        if status == "cancelled":
+            self.output(f"Выполнение прервано ({tab.name})")
+        elif status == "timeout":
+            status = "cancelled"
+        self._debugger_insert("=" * 30 + f" END ({tab.name}) " + "=" * 30 + "\n\n")
+        try:
+            current_tab, _, _ = self.get_current_editor()
+        except Exception:
+            return
+        if current_tab is tab:
+            self.update_run_status(status)
+
+    def update_run_status(self, status):
+        """Обновляет индикатор выполнения и кнопку прерывания"""
+        if status == "running":
+            self.run_status_label.config(text="Выполняется...", fg="#ffd700")
+            self.run_kill_button.config(state="normal")
+        elif status == "cancelling":
+            self.run_status_label.config(text="Прерывание...", fg="#ffd700")
+            self.run_kill_button.config(state="disabled")
+        elif status == "cancelled":
+            self.run_status_label.config(text="Прервано", fg=self.colors["error_msg"])
+            self.run_kill_button.config(state="disabled")
+        else:
+            self.run_status_label.config(text="Готов", fg="#4ec9b0")
+            self.run_kill_button.config(state="disabled")
 
     def save_file(self):
         try:
             tab, input_text, _ = self.get_current_editor()
+            if tab.loading:
+                messagebox.showinfo("Сохранение", "Файл еще загружается, сохранение недоступно")
+                return
+            if tab.read_only:
+                messagebox.showinfo("Сохранение", "Вкладка открыта только для чтения")
+                return
 
             filetypes = [
                 ("T-Code files", "*.tcd"),
@@ -1209,15 +2673,44 @@ class CodeApp(tk.Tk):
             else:
                 filepath = tab.path
 
-            with open(filepath, "w", encoding="utf-8") as f:
-                f.write(input_text.get("1.0", tk.END))
-
-            tab.saved = True
-            self.add_system_message(f"Файл сохранен: {os.path.basename(filepath)}")
+            # Снимок буфера пишется в фоне; частые Ctrl+S сливаются в одну запись
+            version = tab.version
+            self.save_queue.save(filepath, input_text.get("1.0", tk.END),
+                                 lambda path, error: self.after(0, self._on_file_saved, tab, path, error, version),
+                                 newline=tab.newline)
 
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось сохранить файл:\n{e}")
 
+    def _on_file_saved(self, tab, path, error, version):
+        if error is not None:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить файл:\n{error}")
+            return
+        if tab.path == path and tab.journal_id is not None:
+            if tab.version == version:
+                # Сохранено именно текущее содержимое - журнал не нужен
+                tab.saved = True
+                self.journal.discard(tab.journal_id)
+                tab.journal_id = None
+            else:
+                # Файл на диске изменился, а правки продолжились - журнал переводится на снимок
+                _, input_text = self.file_editors[self.file_tabs.index(tab)]
+                self.journal.compact(tab.journal_id, self._journal_header(tab),
+                                     input_text.get("1.0", "end-1c"))
+        elif tab.path == path and tab.version == version:
+            tab.saved = True
+        self.add_system_message(f"Файл сохранен: {os.path.basename(path)}")
+
+    def on_close(self):
+        """Выход с дозаписью отложенных сохранений и журнала"""
+        self.save_queue.flush()
+        if self.journal is not None:
+            self.journal.close()
+        for _, editor in self.file_editors:
+            if isinstance(editor, LogViewer):
+                editor.close()
+        self.destroy()
+
     def open_help(self):
         help_window = tk.Toplevel(self)
         help_window.title("Справка")
@@ -17,9 +17,79 @@ class Command:
         self.end = end
 
 
+class CommandResolver:
+    """Префиксное дерево команд: ключ - буквальный префикс start + name"""
+
+    def __init__(self):
+        self.root = {}
+        self.order = {}  # name -> порядок регистрации
+        self.prefixes = {}  # name -> префикс, под которым команда проиндексирована
+
+    def add(self, cmd):
+        """Индексация команды по её префиксу; повторная регистрация заменяет прежний префикс"""
+        self.order.setdefault(cmd.name, len(self.order))
+        old = self.prefixes.get(cmd.name)
+        if old is not None and old != cmd.start + cmd.name:
+            self._remove(cmd.name, old)
+        self.prefixes[cmd.name] = cmd.start + cmd.name
+        node = self.root
+        for char in cmd.start + cmd.name:
+            node = node.setdefault(char, {})
+        names = node.setdefault(None, [])  # None - маркер конца префикса
+        if cmd.name not in names:
+            names.append(cmd.name)
+
+    def _remove(self, name, prefix):
+        """Удаление имени из узла префикса и опустевших узлов"""
+        path = [self.root]
+        for char in prefix:
+            node = path[-1].get(char)
+            if node is None:
+                return
+            path.append(node)
+        names = path[-1].get(None, [])
+        if name in names:
+            names.remove(name)
+        if not names:
+            path[-1].pop(None, None)
+        for depth in range(len(prefix), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][prefix[depth - 1]]
+
+    def candidates(self, command_str):
+        """Имена команд, чей префикс совпадает с началом строки, в порядке регистрации"""
+        found = []
+        node = self.root
+        for char in command_str:
+            node = node.get(char)
+            if node is None:
+                break
+            found.extend(node.get(None, ()))
+        found.sort(key=self.order.__getitem__)
+        return found
+
+    def resolve(self, command_str, commands):
+        """Поиск команды для строки -> (Command, params) или (None, None)"""
+        for name in self.candidates(command_str):
+            cmd = commands[name]
+            start, end = cmd.start, cmd.end
+            inner = command_str[len(start + name):]
+            if end:
+                # Команды с окончанием совпадают по одному только окончанию строки
+                if command_str.endswith(end):
+                    if inner.startswith('(') and inner.endswith(')' + end):
+                        return cmd, inner[1:-1 - len(end)].strip()
+                    return cmd, inner[1:-1].strip()
+            elif inner.startswith('(') and inner.endswith(')'):
+                return cmd, inner[1:-1].strip()
+        return None, None
+
+
 commands = {}
 variables = {}
 gui_hooks = {}
+resolver = CommandResolver()
 current_process = None  # Глобальная переменная для хранения активного процесса
 
 
@@ -29,6 +99,7 @@ def set_gui_hook(name, func):
 
 def add_command(name, arg_count, func, start='', end=''):
     commands[name] = Command(name, arg_count, func, start, end)
+    resolver.add(commands[name])
 
 
 def split_args(params):
@@ -268,90 +339,18 @@ def compile(command_str):
     if command_str.startswith("cmd ") and "(" not in command_str and ")" not in command_str:
         command_str = f'cmd("{command_str[4:]}")'
 
-    for name, cmd in commands.items():
-        start = cmd.start
-        end = cmd.end
-        if start and end:
-            if command_str.startswith(start + name) and command_str.endswith(end):
-                inner = command_str[len(start + name):]
-                if inner.startswith('(') and inner.endswith(')' + end):
-                    params = inner[1:-1 - len(end)].strip()
-                else:
-                    params = inner[1:-1].strip()
-
-                # Используем улучшенный парсер аргументов
-                args = split_args(params) if params else []
-                args = [try_eval(arg) for arg in args]
-
-                if cmd.arg_count != len(args):
-                    return f"Команда '{name}' требует {cmd.arg_count} параметров, получено {len(args)}"
-                try:
-                    return cmd.func(*args)
-                except Exception as e:
-                    return f"Ошибка в функции команды '{name}': {e}"
-            elif command_str.startswith(start + name) and command_str.endswith(')' + end):
-                params = command_str[len(start + name) + 1:-1 - len(end)].strip()
-
-                # Используем улучшенный парсер аргументов
-                args = split_args(params) if params else []
-                args = [try_eval(arg) for arg in args]
-
-                if cmd.arg_count != len(args):
-                    return f"Команда '{name}' требует {cmd.arg_count} параметров, получено {len(args)}"
-                try:
-                    return cmd.func(*args)
-                except Exception as e:
-                    return f"Ошибка в функции команды '{name}': {e}"
-        elif start:
-            if command_str.startswith(start + name):
-                inner = command_str[len(start + name):]
-                if inner.startswith('(') and inner.endswith(')'):
-                    params = inner[1:-1].strip()
-
-                    # Используем улучшенный парсер аргументов
-                    args = split_args(params) if params else []
-                    args = [try_eval(arg) for arg in args]
-
-                    if cmd.arg_count != len(args):
-                        return f"Команда '{name}' требует {cmd.arg_count} параметров, получено {len(args)}"
-                    try:
-                        return cmd.func(*args)
-                    except Exception as e:
-                        return f"Ошибка в функции команды '{name}': {e}"
-        elif end:
-            if command_str.startswith(name) and command_str.endswith(end):
-                inner = command_str[len(name):]
-                if inner.startswith('(') and inner.endswith(')' + end):
-                    params = inner[1:-1 - len(end)].strip()
-                else:
-                    params = inner[1:-1].strip()
-
-                # Используем улучшенный парсер аргументов
-                args = split_args(params) if params else []
-                args = [try_eval(arg) for arg in args]
-
-                if cmd.arg_count != len(args):
-                    return f"Команда '{name}' требует {cmd.arg_count} параметров, получено {len(args)}"
-                try:
-                    return cmd.func(*args)
-                except Exception as e:
-                    return f"Ошибка в функции команды '{name}': {e}"
-        else:
-            if command_str.startswith(name):
-                inner = command_str[len(name):]
-                if inner.startswith('(') and inner.endswith(')'):
-                    params = inner[1:-1].strip()
-
-                    # Используем улучшенный парсер аргументов
-                    args = split_args(params) if params else []
-                    args = [try_eval(arg) for arg in args]
-
-                    if cmd.arg_count != len(args):
-                        return f"Команда '{name}' требует {cmd.arg_count} параметров, получено {len(args)}"
-                    try:
-                        return cmd.func(*args)
-                    except Exception as e:
-                        return f"Ошибка в функции команды '{name}': {e}"
+    cmd, params = resolver.resolve(command_str, commands)
+    if cmd is not None:
+        # Используем улучшенный парсер аргументов
+        args = split_args(params) if params else []
+        args = [try_eval(arg) for arg in args]
+
+        if cmd.arg_count != len(args):
+            return f"Команда '{cmd.name}' требует {cmd.arg_count} параметров, получено {len(args)}"
+        try:
+            return cmd.func(*args)
+        except Exception as e:
+            return f"Ошибка в функции команды '{cmd.name}': {e}"
 
     try:
         # Автоматическое преобразование команд типа "cmd <command>"
@@ -0,0 +1,63 @@
+# Микро-бенчмарк: префиксное дерево mcmd.CommandResolver против линейного обхода commands
+# Запуск из корня проекта: python scripts/bench_mcmd.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mcmd import Command, CommandResolver
+
+
+def linear_resolve(commands, command_str):
+    """Прежний алгоритм mcmd.compile: проверка каждой команды по очереди"""
+    for name, cmd in commands.items():
+        start = cmd.start
+        end = cmd.end
+        if end:
+            if command_str.startswith(start + name) and command_str.endswith(end):
+                return cmd
+        elif command_str.startswith(start + name):
+            inner = command_str[len(start + name):]
+            if inner.startswith('(') and inner.endswith(')'):
+                return cmd
+    return None
+
+
+def build_commands(count):
+    """Набор команд со всеми вариантами start/end"""
+    decorations = [('', ''), ('!', ''), ('', ';'), ('<', '>')]
+    commands = {}
+    resolver = CommandResolver()
+    for n in range(count):
+        start, end = decorations[n % len(decorations)]
+        name = f"plugin{n}.run"
+        commands[name] = Command(name, 1, None, start, end)
+        resolver.add(commands[name])
+    return commands, resolver
+
+
+def main(number=2000):
+    lines = {
+        "python": "result = sum(range(10))",
+        "last": None,
+    }
+    print(f"{'команд':>8} {'строка':>8} {'линейно, мкс':>14} {'дерево, мкс':>13}")
+    for count in (10, 100, 1000):
+        commands, resolver = build_commands(count)
+        last = commands[f"plugin{count - 1}.run"]
+        lines["last"] = f"{last.start}{last.name}(42){last.end}"
+
+        for label, line in lines.items():
+            expected = linear_resolve(commands, line)
+            found, _ = resolver.resolve(line, commands)
+            assert found is expected, (line, found, expected)
+
+            linear = timeit.timeit(lambda: linear_resolve(commands, line), number=number)
+            trie = timeit.timeit(lambda: resolver.resolve(line, commands), number=number)
+            print(f"{count:>8} {label:>8} {linear / number * 1e6:>14.2f} {trie / number * 1e6:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+# storage.py
+# Сохранение файлов редактора вне потока интерфейса
+
+import os
+import json
+import uuid
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _read_umask():
+    # Узнать umask можно только установив новую; читаем один раз при импорте, до фоновых потоков записи
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+
+_UMASK = _read_umask()
+
+
+def atomic_write(path, text, encoding="utf-8", newline=None):
+    """Запись через временный файл, fsync и os.replace: при сбое старый файл остается целым"""
+    path = os.path.realpath(path)  # для символической ссылки заменяется файл, а не сама ссылка
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding=encoding, newline=newline) as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o666 & ~_UMASK)  # mkstemp создает файл с правами 0600
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class SaveQueue:
+    """Фоновая очередь сохранений: повторные сохранения файла в пределах окна сливаются в одну запись"""
+
+    def __init__(self, coalesce_delay=0.3):
+        self.coalesce_delay = coalesce_delay
+        self.pending = {}  # путь -> [текст, колбэки, время записи, перевод строки]
+        self.writing = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def save(self, path, text, callback=None, newline=None):
+        """Постановка снимка буфера в очередь; callback(path, error) вызывается из рабочего потока.
+        newline - перевод строки в файле (None - системный)"""
+        with self.condition:
+            entry = self.pending.get(path)
+            if entry is None:
+                entry = self.pending[path] = [text, [], time.monotonic() + self.coalesce_delay, newline]
+            else:
+                entry[0] = text  # в файл попадет самый свежий снимок
+                entry[3] = newline
+            if callback is not None:
+                entry[1].append(callback)
+            self.condition.notify()
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while True:
+                    now = time.monotonic()
+                    due = [(entry[2], path) for path, entry in self.pending.items()]
+                    if due:
+                        when, path = min(due)
+                        if when <= now:
+                            break
+                        self.condition.wait(when - now)
+                    else:
+                        self.condition.wait()
+                text, callbacks, _, newline = self.pending.pop(path)
+                self.writing = True
+
+            error = None
+            try:
+                atomic_write(path, text, newline=newline)
+            except Exception as e:
+                error = e
+
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+            for callback in callbacks:
+                try:
+                    callback(path, error)
+                except Exception:
+                    pass
+
+    def flush(self, timeout=5):
+        """Немедленная запись всего, что стоит в очереди (например, при выходе)"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            for entry in self.pending.values():
+                entry[2] = 0
+            self.condition.notify_all()
+            while self.pending or self.writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+def _try_lock(path):
+    """Открытый файл с исключительной блокировкой или None, если ее держит другой процесс.
+    Блокировку снимает ОС при завершении процесса, поэтому она переживает только живого владельца"""
+    try:
+        f = open(path, "a+b")
+    except OSError:
+        return None
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+class EditJournal:
+    """Журнал правок несохраненных буферов: дописывается пачками в фоне, сжимается до снимка.
+    Файлы журналов называются "<владелец>.<id>.journal"; владелец - запущенная IDE, которая
+    держит блокировку "<владелец>.lock", пока жива"""
+
+    def __init__(self, directory, flush_interval=1.0, compact_every=5000):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self.entries = {}  # id журнала -> состояние
+        self.lock = threading.Lock()
+        self.io_lock = threading.Lock()  # пачки одного журнала пишутся строго по порядку
+        self.wakeup = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self.owner = uuid.uuid4().hex
+        self.owner_lock = _try_lock(self._lock_file(self.owner))
+        self.claimed = {}  # владелец -> блокировка журналов завершившейся IDE, взятых на восстановление
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def _file(self, journal_id):
+        return os.path.join(self.directory, f"{self.owner}.{journal_id}.journal")
+
+    def _lock_file(self, owner):
+        return os.path.join(self.directory, f"{owner}.lock")
+
+    def open(self, header):
+        """Новый журнал буфера; header - dict с путем и отпечатком исходного файла"""
+        journal_id = uuid.uuid4().hex
+        with self.lock:
+            self.entries[journal_id] = {
+                "pending": [header],
+                "rewrite": None,
+                "count": 0,
+                "discarded": False,
+                "broken": False,  # дозапись не удалась - хвост файла ненадежен до следующего снимка
+            }
+        return journal_id
+
+    def append(self, journal_id, record):
+        """Запись дельты; True - пора сжать журнал (compact)"""
+        with self.lock:
+            entry = self.entries[journal_id]
+            entry["pending"].append(record)
+            entry["count"] += 1
+            return entry["count"] >= self.compact_every or entry["broken"]
+
+    def compact(self, journal_id, header, text):
+        """Замена накопленных дельт снимком буфера"""
+        with self.lock:
+            entry = self.entries[journal_id]
+            entry["rewrite"] = [header, {"t": "s", "text": text}]
+            entry["pending"] = []
+            entry["count"] = 0
+            entry["broken"] = False
+        self.wakeup.set()
+
+    def discard(self, journal_id):
+        """Буфер сохранен - журнал больше не нужен"""
+        with self.lock:
+            entry = self.entries.get(journal_id)
+            if entry is not None:
+                entry["discarded"] = True
+        self.wakeup.set()
+
+    def _worker(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Запись накопленных пачек на диск"""
+        with self.io_lock:
+            self._flush()
+
+    def _flush(self):
+        with self.lock:
+            batches = []
+            for journal_id, entry in self.entries.items():
+                if entry["discarded"]:
+                    batches.append((journal_id, None, None))
+                elif entry["rewrite"] or (entry["pending"] and not entry["broken"]):
+                    # После неудачной дозаписи дельты копятся в памяти до снимка, который перепишет файл
+                    batches.append((journal_id, entry["rewrite"], entry["pending"]))
+                    entry["rewrite"] = None
+                    entry["pending"] = []
+
+        for journal_id, rewrite, pending in batches:
+            path = self._file(journal_id)
+            try:
+                if rewrite is None and pending is None:
+                    if os.path.exists(path):
+                        os.remove(path)
+                elif rewrite is not None:
+                    atomic_write(path, "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rewrite + pending))
+                else:
+                    with open(path, "a", encoding="utf-8") as f:
+                        f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in pending))
+                        f.flush()
+                        os.fsync(f.fileno())
+            except OSError:
+                # Журнал - страховка, ошибки записи не должны мешать работе, но и терять пачку нельзя:
+                # она возвращается в очередь и пишется при следующем сбросе
+                self._requeue(journal_id, rewrite, pending)
+                continue
+            if rewrite is None and pending is None:
+                with self.lock:
+                    self.entries.pop(journal_id, None)
+
+    def _requeue(self, journal_id, rewrite, pending):
+        with self.lock:
+            entry = self.entries.get(journal_id)
+            if entry is None or entry["discarded"]:
+                return  # удаление повторится при следующем сбросе
+            if entry["rewrite"] is not None:
+                return  # за время записи появился более свежий снимок, он заменяет эту пачку
+            if rewrite is not None:
+                entry["rewrite"] = rewrite
+            else:
+                entry["broken"] = True  # файл мог остаться с оборванной записью
+            entry["pending"] = pending + entry["pending"]
+
+    def _claim(self, owner):
+        """True - владелец журналов завершился, и теперь они принадлежат этому процессу"""
+        if owner == self.owner:
+            return False
+        if owner not in self.claimed:
+            lock = _try_lock(self._lock_file(owner))
+            if lock is None:
+                return False  # журналы другой запущенной IDE
+            self.claimed[owner] = lock
+        return True
+
+    def load_all(self):
+        """Журналы завершившихся IDE -> [(файл, записи)]; журналы запущенных пропускаются"""
+        journals = []
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".journal"):
+                continue
+            parts = filename.split(".")
+            if len(parts) != 3 or not self._claim(parts[0]):
+                continue
+            path = os.path.join(self.directory, filename)
+            records = []
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            break  # оборванная последняя запись при сбое
+            except OSError:
+                continue
+            if records and records[0].get("t") == "h":
+                journals.append((path, records))
+            else:
+                self.remove_file(path)  # владелец упал до записи заголовка - восстанавливать нечего
+        return journals
+
+    def release_claims(self):
+        """Снятие блокировок завершившихся IDE после восстановления их журналов"""
+        for owner, lock in self.claimed.items():
+            lock.close()  # Windows не дает удалить открытый файл
+            if not any(name.startswith(owner + ".") and name.endswith(".journal")
+                       for name in os.listdir(self.directory)):
+                self.remove_file(self._lock_file(owner))
+        self.claimed = {}
+
+    def close(self):
+        """Дозапись журналов и снятие своей блокировки при выходе.
+        Оставшиеся журналы несохраненных буферов заберет следующий запуск: файл блокировки ему не нужен"""
+        self.flush()
+        if self.owner_lock is not None:
+            self.owner_lock.close()
+            self.owner_lock = None
+            self.remove_file(self._lock_file(self.owner))
+
+    def remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
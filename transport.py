@@ -0,0 +1,129 @@
+# transport.py
+# HTTP-транспорт запросов к ИИ с возможностью оборвать запрос из другого потока
+
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+_local = threading.local()  # запрос, выполняемый текущим потоком
+
+
+class RequestCancelled(Exception):
+    """Запрос отменен пользователем"""
+
+
+class RequestHandle:
+    """Отменяемый запрос: хранит занятое соединение и ответ, чтобы закрыть их при отмене"""
+
+    def __init__(self, request_id):
+        self.id = request_id
+        self.cancelled = False
+        self.connection = None
+        self.response = None
+        self.lock = threading.Lock()
+
+    def attach(self, connection):
+        with self.lock:
+            self.connection = connection
+            cancelled = self.cancelled
+        if cancelled:
+            self._shutdown(connection)
+
+    def set_response(self, response):
+        with self.lock:
+            self.response = response
+        if self.cancelled:
+            response.close()
+
+    def cancel(self):
+        """Обрыв соединения: блокирующее чтение в потоке запроса сразу завершается ошибкой"""
+        with self.lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            connection, response = self.connection, self.response
+        if connection is not None:
+            self._shutdown(connection)
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def release(self):
+        """Запрос завершен: соединение вернулось в пул и может обслуживать чужой запрос,
+        поэтому поздняя отмена больше не должна его закрывать"""
+        with self.lock:
+            self.connection = None
+            self.response = None
+
+    def check(self):
+        if self.cancelled:
+            raise RequestCancelled()
+
+    @staticmethod
+    def _shutdown(connection):
+        sock = getattr(connection, "sock", None)
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def bind(handle):
+    """Привязка запроса к текущему потоку: выданные ему соединения запоминаются в handle"""
+    _local.handle = handle
+
+
+def _track(connection):
+    handle = getattr(_local, "handle", None)
+    if handle is not None:
+        handle.attach(connection)
+    return connection
+
+
+class _TrackedHTTPPool(HTTPConnectionPool):
+    def _get_conn(self, timeout=None):
+        return _track(super()._get_conn(timeout))
+
+
+class _TrackedHTTPSPool(HTTPSConnectionPool):
+    def _get_conn(self, timeout=None):
+        return _track(super()._get_conn(timeout))
+
+
+class CancellableAdapter(HTTPAdapter):
+    """Адаптер requests, пулы которого сообщают запросу его соединение"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TrackedHTTPPool,
+            "https": _TrackedHTTPSPool,
+        }
+
+
+def create_session(pool_size=4, retries=2, backoff=0.5):
+    """Постоянная сессия requests: пул keep-alive соединений, повторы с паузой, отменяемые запросы"""
+    session = requests.Session()
+    # Повторяются только сбои подключения и ответы "сервер занят": прочитанная генерация не дублируется
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=None,
+        raise_on_status=False,
+    )
+    adapter = CancellableAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session